@@ -1,17 +1,62 @@
 import sys
 import os
-import re
 import logging
-import feedparser
-import requests
-import html
-from bs4 import BeautifulSoup
+import argparse
+import asyncio
 from datetime import datetime, timedelta, timezone
 from src.utils import SceneDownload
+from src.release import load_preferences
+from src.pipeline import Pipeline
+from src.daemon import Daemon
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent / 'src'))
 
+parser = argparse.ArgumentParser(description='find and download scene TV shows')
+parser.add_argument('--compact-seen', type=int, metavar='DAYS',
+    help='expire seen entries older than DAYS, compact the db and exit')
+parser.add_argument('--daemon', action='store_true',
+    help='keep running, polling each source on its own interval')
+parser.add_argument('--reorganize', metavar='DIR',
+    help='rename the library under DIR into per-show clean names, dry run unless --apply')
+parser.add_argument('--apply', action='store_true',
+    help='with --reorganize, carry out the plan and write an undo log')
+parser.add_argument('--undo', metavar='LOG',
+    help='put back the moves recorded in a reorganize undo log and exit')
+args = parser.parse_args()
+
+if args.compact_seen is not None:
+    import plyvel
+    from src.seen import SeenStore
+    worker = os.getenv('AUTOFOO_WORKER')
+    db_path = os.path.join(SceneDownload.DB_PATH, worker) if worker else SceneDownload.DB_PATH
+    os.makedirs(db_path, exist_ok=True)
+    db = plyvel.DB(db_path, create_if_missing=True)
+    removed = SeenStore(db).compact(args.compact_seen)
+    db.close()
+    print(f'Expired {removed} seen entries older than {args.compact_seen} days')
+    sys.exit(0)
+
+if args.reorganize or args.undo:
+    from src.naming import load_scene_tags
+    from src.reorganize import Reorganizer
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s')
+    if args.undo:
+        Reorganizer.undo(args.undo)
+        sys.exit(0)
+    reorganizer = Reorganizer(args.reorganize,
+        scene_tags=load_scene_tags(os.getenv('AUTOFOO_SCENE_TAGS', SceneDownload.SCENE_TAGS)))
+    moves, skipped = reorganizer.plan()
+    if not args.apply:
+        print(reorganizer.diff(moves, skipped))
+        print(f'{len(moves)} file(s) to move, {len(skipped)} skipped, --apply to go ahead')
+        sys.exit(0)
+    os.makedirs('logs', exist_ok=True)
+    undo_log = os.path.join('logs', f"reorganize_{datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}.jsonl")
+    reorganizer.apply(moves, undo_log)
+    print(f'Undo with: {sys.argv[0]} --undo {undo_log}')
+    sys.exit(0)
+
 upo = os.getenv('NTFLR_USERNAME')
 if not upo:
     print('NTFLR_USERNAME not set')
@@ -24,89 +69,46 @@ sdx = SceneDownload(
     ),
     uxs=upo,
     pxs=os.getenv('NTFLR_PREMIUM'),
+    max_downloads=int(os.getenv('AUTOFOO_MAX_DOWNLOADS', '3')),
+    max_rate=int(os.getenv('AUTOFOO_MAX_RATE', '0')) or None,   # bytes/sec
+    browser_workers=int(os.getenv('AUTOFOO_BROWSERS', '3')),
+    worker=os.getenv('AUTOFOO_WORKER'),         # own LevelDB under ./cache/<worker>/
+    claims=os.getenv('AUTOFOO_CLAIMS'),         # shared SQLite claims file
+    hosters=tuple(os.getenv('AUTOFOO_HOSTERS', 'nitroflare').split(',')),
+    hoster_config={'nitroflare': {'api': os.getenv('NTFLR_API')}},   # e.g. a local stub
+    scene_tags=os.getenv('AUTOFOO_SCENE_TAGS'),     # ripper tags cut from episode titles
     logging_verbose=True)
 tvshows_ = sdx.load_tvshows()
 
-def can_process(title, splitstr='1080'):
-    test = title.upper()
-    keys = ('AV1','HEVC','X265','H265')
-    return (splitstr in test and \
-        'NF' in test and \
-        any(key in test for key in keys))
-
-def isit(subs, inthis):
-    if subs in inthis:
-        return subs
-    else:
-        return None
-
-def go_show(title):
-    # the title needs to be sanitized
-    match = re.search(sdx.season_episode_regex, title, re.IGNORECASE)
-    if not match:
-        sanshow = title.upper()
-    else:
-        sanshow, _ = match.groups()
-    sanshow = sanshow.split(']')[1].strip().upper()
-    # straight equivalence
-    return sanshow in tvshows_
-
 basesrl = 'https://scene-rls.net/releases/index.php?'
 
 urls = [
-    {'source':'https://rapidmoviez.com/feed/s','type':'RSS'},
-    {'source':'https://rapidmoviez.com/feed/m','type':'RSS'},
+    {'source':'https://rapidmoviez.com/feed/s','type':'RSS','interval':15*60},
+    {'source':'https://rapidmoviez.com/feed/m','type':'RSS','interval':15*60},
     {'source':'feed.xml','type':'FILE'},
 ]
 
-delta = (datetime.now() - timedelta(hours=12)).replace(tzinfo=timezone.utc)
-process = []
-for uri in urls:
-
-    url = uri['source']
-    logging.info(url)
-    if uri['type'] == 'RSS':
-        feed = feedparser.parse(url)
-        entries = feed.entries
-    elif uri['type'] == 'FILE' and os.path.exists(url):
-        feed = feedparser.parse(url)
-        entries = feed.entries
-        # cleanup the feed.xml file
-        os.remove(url)
-    else:
-        try:
-            logging.info(f"""{uri['type']}: {uri['regex']['first']}""")
-            entries = sdx.get_first_links(url)
-        except:
-            pass
-        continue
-
-    # Iterate through entries and filter by the time and keyword
-    # further filter by shows of interest
-    logging.info(f'Evaluating {len(feed.entries)} potential shows')
-    for entry in entries:
-        splitstr = isit('1080',entry.title.upper())
-        if not splitstr:
-            splitstr = isit('2160zzz',entry.title.upper())
-        if not splitstr:
-            continue
+resolutions = tuple(os.getenv('AUTOFOO_RESOLUTIONS', '1080').split(','))
 
-        test = entry.title.upper().split(splitstr)[0].strip().split(']')[-1].strip()
-        test = sdx.sanitize_show(test)
-        print(f"<test> {test}")
-        if can_process(entry.title, splitstr) \
-            and go_show(entry.title) \
-            and sdx.not_seen(test):
-            sdx.add_seen_show(test) # no repeat downloads!!!!
-            entry['test'] = test
-            logging.info(f'Adding {test} for further processing...')
-            process.append(entry)
+if args.daemon:
+    # the daemon builds feed.xml itself, same pages as the autofoo wrapper
+    listing = ','.join(['https://rapidmoviez.com/feature/x265'] + \
+        [f'https://rapidmoviez.com/feature/x265/b/{i}' for i in range(2, 32)])
+    sources = urls[:2] + [{'source':listing,'type':'LISTING','interval':30*60}]
+    daemon = Daemon(sdx, sources,
+        metrics_port=int(os.getenv('AUTOFOO_METRICS_PORT', 0)) or None,
+        resolutions=resolutions,
+        preferences=load_preferences())
+    asyncio.run(daemon.run())
+    sys.exit(0)
 
-nlx = []
-for show in sorted(process, \
-    key=lambda x: datetime.strptime(x.published, "%a, %d %b %Y %H:%M:%S %z").timestamp()):
-    nlx.append((sdx.load_page(show.link), show.test))
+delta = (datetime.now(timezone.utc) - timedelta(hours=12)).timestamp()
 
+pipeline = Pipeline(sdx, urls,
+    shows=tvshows_,
+    resolutions=resolutions,
+    preferences=load_preferences(),
+    cutoff=delta)
+asyncio.run(pipeline.run())
 sdx.close()
-sdx.download_files(nlx)
-#sdx._view_db()
\ No newline at end of file
+#sdx._view_db()
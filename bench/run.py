@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Offline autofoo benchmarks, nothing leaves the machine.
+
+    python -m bench.run --output bench.json
+    python -m bench.run --baseline bench.json --tolerance 0.25
+
+Micro benchmarks time the hot helpers at large sizes, the rest run the
+real code paths against bench.stub on a local port. Results are JSON,
+with --baseline any benchmark more than tolerance slower per op than
+the baseline fails the run.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+
+import aiohttp
+import plyvel
+from aiohttp import web
+
+from bench import stub
+from src.release import classify, parse_release
+from src.seen import SeenStore, CANDIDATE, DOWNLOADED, META_BLOOM
+from src.titles import TitleIndex
+
+BENCHMARKS = {}
+
+
+def bench(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def timed(fn, ops):
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    return {'ops': ops, 'seconds': seconds}
+
+
+class Stub:
+    """
+    bench.stub on its own event loop thread, so the code under test can
+    run asyncio.run as it does in production.
+    """
+
+    def __init__(self, **kwargs):
+        self.app = stub.make_app(**kwargs)
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+        self.port = None
+
+    async def _start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    @property
+    def base(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    @property
+    def calls(self):
+        return dict(self.app['calls'])
+
+
+def synthetic_titles(count, seed=1):
+    rng = random.Random(seed)
+    words = ('the', 'last', 'night', 'house', 'of', 'dragon', 'road', 'blue', 'lights',
+        'murders', 'in', 'building', 'slow', 'horses', 'bad', 'sisters', 'us', 'uk')
+    resolutions = ('720p', '1080p', '2160p')
+    codecs = ('x264', 'x265', 'HEVC', 'AV1', 'H.264')
+    titles = []
+    for n in range(count):
+        show = '.'.join(rng.choice(words).capitalize() for _ in range(rng.randint(1, 4)))
+        titles.append(f'{show}.S{rng.randint(1, 30):02d}E{rng.randint(1, 24):02d}.'
+            f'Episode.Title.{n}.{rng.choice(resolutions)}.WEB-DL.{rng.choice(codecs)}-GRP{n % 97}')
+    return titles
+
+
+def scene_download(**kwargs):
+    from src.utils import SceneDownload
+    return SceneDownload(download_dir=os.path.abspath('dl'), uxs='bench', pxs='bench', **kwargs)
+
+
+@bench('clean_filename')
+def bench_clean_filename(scale):
+    sdx = scene_download()
+    names = [f'{title}.mkv' for title in synthetic_titles(int(50000 * scale))]
+    result = timed(lambda: [sdx.clean_filename(name) for name in names], len(names))
+    sdx.close()
+    return result
+
+
+@bench('sanitize_show')
+def bench_sanitize_show(scale):
+    sdx = scene_download()
+    names = synthetic_titles(int(50000 * scale))
+    result = timed(lambda: [sdx.sanitize_show(name) for name in names], len(names))
+    sdx.close()
+    return result
+
+
+@bench('filter_loop')
+def bench_filter_loop(scale):
+    titles = synthetic_titles(int(100000 * scale))
+    shows = sorted({parse_release(title).show for title in titles[::3]})
+    parse_release.cache_clear()
+    with open('tvshows.list', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(shows))
+    index = TitleIndex('tvshows.list').open()
+    result = timed(lambda: classify(titles, shows=index, resolutions=('1080', '2160')), len(titles))
+    index.close()
+    return result
+
+
+@bench('title_index_build')
+def bench_title_index_build(scale):
+    count = int(100000 * scale)
+    with open('tvshows.list', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(f'Show Number {n} ({1950 + n % 70})' for n in range(count)))
+    index = TitleIndex('tvshows.list')
+    return timed(lambda: index.open().close(), count)
+
+
+def _seen_store(count):
+    db = plyvel.DB('seen', create_if_missing=True)
+    store = SeenStore(db)
+    for n in range(count):
+        store.mark(f'SHOW.NUMBER.{n}.S01E{n % 24 + 1:02d}', CANDIDATE if n % 2 else DOWNLOADED)
+    store.close()
+    return db
+
+
+@bench('seen_mark')
+def bench_seen_mark(scale):
+    count = int(200000 * scale)
+    result = timed(lambda: _seen_store(count).close(), count)
+    shutil.rmtree('seen')
+    return result
+
+
+@bench('seen_warm')
+def bench_seen_warm(scale):
+    count = int(200000 * scale)
+    db = _seen_store(count)
+    # a stale snapshot forces the full scan a crashed run leaves behind
+    db.delete(META_BLOOM)
+    result = timed(lambda: SeenStore(db), count)
+    db.close()
+    shutil.rmtree('seen')
+    return result
+
+
+@bench('seen_lookup')
+def bench_seen_lookup(scale):
+    count = int(200000 * scale)
+    db = _seen_store(count)
+    store = SeenStore(db)
+    # half hits, half misses the bloom filter answers alone
+    keys = [f'SHOW.NUMBER.{n}.S01E{n % 24 + 1:02d}' for n in range(0, 2 * count, 2)]
+    result = timed(lambda: [store.seen_any(key) for key in keys], len(keys))
+    db.close()
+    shutil.rmtree('seen')
+    return result
+
+
+@bench('genrss')
+def bench_genrss(scale):
+    import genrss
+    pages = 31
+    with Stub(latency=0.05) as server:
+        uris = ','.join([f'{server.base}/feature/x265'] +
+            [f'{server.base}/feature/x265/b/{n}' for n in range(2, pages + 1)])
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = timed(lambda: genrss.generate_rss_feed(uris, output_file='feed.xml',
+                all_pages=True, state_file='genrss.state.json'), pages)
+        result['requests'] = server.calls
+    return result
+
+
+@bench('range_download')
+def bench_range_download(scale, size=None):
+    from src.download import RangeDownload
+    size = int(size or 256 * 1024 ** 2 * scale)
+
+    async def run(base):
+        async with aiohttp.ClientSession() as session:
+            transfer = RangeDownload(session, f'{base}/dl/BENCH000000', os.path.abspath('payload.bin'))
+            return await transfer.run()
+
+    with Stub(size=size) as server:
+        result = timed(lambda: asyncio.run(run(server.base)), 1)
+    result['bytes'] = size
+    result['mb_per_sec'] = size / result['seconds'] / 1e6
+    os.remove('payload.bin')
+    return result
+
+
+@bench('pipeline')
+def bench_pipeline(scale, size=None):
+    from src.pipeline import Pipeline
+    episodes = max(1, int(24 * scale))
+    size = int(size or 16 * 1024 ** 2)
+    with Stub(latency=0.02, size=size, episodes=episodes) as server:
+        os.makedirs('dl', exist_ok=True)
+        with open('tvshows.list', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(stub.SHOWS))
+        sdx = scene_download(max_downloads=4,
+            hoster_config={'nitroflare': {'api': f'{server.base}/api/v2'}})
+        sdx.load_tvshows()
+        pipeline = Pipeline(sdx, [{'source': f'{server.base}/rss', 'type': 'RSS'}],
+            shows=sdx.tvshows_, resolutions=('1080',))
+        result = timed(lambda: asyncio.run(pipeline.run()), episodes)
+        sdx.close()
+        result['requests'] = server.calls
+    downloaded = len(os.listdir('dl'))
+    result['downloaded'] = downloaded
+    result['mb_per_sec'] = downloaded * size / result['seconds'] / 1e6
+    return result
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """
+    Names of benchmarks more than tolerance slower per op than baseline.
+    """
+    slower = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        ratio = (result['seconds'] / result['ops']) / (base['seconds'] / base['ops'])
+        result['vs_baseline'] = ratio
+        if ratio > 1 + tolerance:
+            slower.append(name)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline autofoo benchmarks')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run, default all of {", ".join(BENCHMARKS)}')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies every problem size')
+    parser.add_argument('--size', type=float, help='payload bytes for range_download and pipeline')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown per op')
+    args = parser.parse_args()
+
+    # the code under test logs at INFO, keep that out of the timings
+    logging.basicConfig(level=logging.WARNING)
+    names = args.names or list(BENCHMARKS)
+    home = os.getcwd()
+    results = {}
+    for name in names:
+        work = tempfile.mkdtemp(prefix=f'autofoo-bench-{name}-')
+        os.chdir(work)
+        try:
+            fn = BENCHMARKS[name]
+            kwargs = {'size': args.size} if args.size and name in ('range_download', 'pipeline') else {}
+            result = fn(args.scale, **kwargs)
+        finally:
+            os.chdir(home)
+            shutil.rmtree(work, ignore_errors=True)
+        result['per_op_us'] = result['seconds'] / result['ops'] * 1e6
+        result['ops_per_sec'] = result['ops'] / result['seconds']
+        results[name] = result
+        print(f"{name:20} {result['ops']:>8} ops {result['seconds']:9.3f}s"
+            f" {result['per_op_us']:12.1f} us/op", file=sys.stderr)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': args.scale,
+        },
+        'results': results,
+    }
+    slower = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        report['regressions'] = slower
+        for name in slower:
+            print(f"REGRESSION {name}: {results[name]['vs_baseline']:.2f}x baseline", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
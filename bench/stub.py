@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for rapidmoviez and the NitroFlare api, for benchmarks.
+
+    python -m bench.stub --port 8765 --latency 0.05 --bandwidth 50e6
+
+Serves /rss, listing pages at /feature/x265 and /feature/x265/b/<n>,
+release pages at /release/<n>, /api/v2/getKeyInfo, getFileInfo and
+getDownloadLink, and range-capable payloads at /dl/<id>. Payloads are
+generated on the fly, byte i of every file is i % 256, so multi-GB
+sizes cost no memory.
+"""
+import argparse
+import asyncio
+import collections
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+
+SHOWS = ('Lazarus', 'The Monster of Florence', 'Waterloo Road', 'Slow Horses',
+    'Only Murders in the Building', 'Taskmaster', 'The Diplomat', 'Shrinking')
+BLOCK = bytes(range(256)) * 256     # 64 KiB, payloads repeat it
+PER_PAGE = 40
+
+
+def release_title(n, codec='HEVC'):
+    show = SHOWS[n % len(SHOWS)].replace(' ', '.')
+    return f'{show}.S{n // 100 + 1:02d}E{n % 100 + 1:02d}.1080p.NF.WEB-DL.{codec}-GRP'
+
+
+def file_id(n):
+    return f'BENCH{n:06d}'
+
+
+def payload(start, end):
+    """
+    Bytes start..end inclusive of any payload, in BLOCK sized pieces.
+    """
+    offset = start
+    while offset <= end:
+        i = offset % len(BLOCK)
+        piece = BLOCK[i:i + min(len(BLOCK) - i, end - offset + 1)]
+        yield piece
+        offset += len(piece)
+
+
+async def _latency(request):
+    if request.app['latency']:
+        await asyncio.sleep(request.app['latency'])
+
+
+@web.middleware
+async def count(request, handler):
+    request.app['calls'][request.match_info.route.name] += 1
+    await _latency(request)
+    return await handler(request)
+
+
+async def rss(request):
+    app = request.app
+    base = f'{request.scheme}://{request.host}'
+    now = datetime.now(timezone.utc)
+    items = []
+    for n in range(app['episodes']):
+        stamp = (now - timedelta(minutes=n)).strftime('%a, %d %b %Y %H:%M:%S %z')
+        items.append(f'<item><title>{release_title(n)}</title><link>{base}/release/{n}</link>'
+            f'<guid>{base}/release/{n}</guid><pubDate>{stamp}</pubDate></item>')
+    text = '<?xml version="1.0"?><rss version="2.0"><channel><title>bench</title>' + \
+        ''.join(items) + '</channel></rss>'
+    return web.Response(text=text, content_type='application/rss+xml')
+
+
+async def listing(request):
+    page = int(request.match_info.get('page', '1'))
+    rows = []
+    for k in range(PER_PAGE):
+        n = (page - 1) * PER_PAGE + k
+        rows.append(f'<tr><td><a href="/release/{n}">{release_title(n)}</a></td>'
+            f'<td>{"x" * 200}</td></tr>')
+        rows.append(f'<tr><td><a href="/other/{n}">Other.Movie.{n}.720p.x264-GRP</a></td></tr>')
+    text = '<html><body>' + '<p>filler</p>' * 200 + '<table>' + ''.join(rows) + \
+        '</table></body></html>'
+    return web.Response(text=text, content_type='text/html')
+
+
+async def release(request):
+    n = int(request.match_info['n'])
+    text = f'<html><body><h1>{release_title(n)}</h1>' + '<p>filler</p>' * 100 + \
+        '<h4 class="links">NitroFlare:</h4><pre class="links">' \
+        f'https://nitroflare.com/view/{file_id(n)}/{release_title(n)}.mkv</pre></body></html>'
+    return web.Response(text=text, content_type='text/html')
+
+
+async def keyinfo(request):
+    traffic = request.app['traffic']
+    return web.json_response({'type': 'success', 'result': {'status': 'active',
+        'trafficLeft': traffic, 'trafficMax': traffic}})
+
+
+async def fileinfo(request):
+    size = request.app['size']
+    files = {}
+    for i in request.query['files'].split(','):
+        files[i] = {'status': 'online', 'name': f'{release_title(int(i[5:]))}.mkv', 'size': str(size)}
+    return web.json_response({'type': 'success', 'result': {'files': files}})
+
+
+async def downloadlink(request):
+    i = request.query['file']
+    base = f'{request.scheme}://{request.host}'
+    return web.json_response({'type': 'success', 'result': {
+        'name': f'{release_title(int(i[5:]))}.mkv', 'url': f'{base}/dl/{i}'}})
+
+
+async def download(request):
+    size = request.app['size']
+    bandwidth = request.app['bandwidth']
+    start, end, status = 0, size - 1, 200
+    headers = {'Accept-Ranges': 'bytes'}
+    if 'Range' in request.headers:
+        first, last = request.headers['Range'].split('=', 1)[1].split('-')
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response = web.StreamResponse(status=status, headers=headers)
+    response.content_length = end - start + 1
+    await response.prepare(request)
+    for piece in payload(start, end):
+        await response.write(piece)
+        if bandwidth:
+            await asyncio.sleep(len(piece) / bandwidth)
+    return response
+
+
+def make_app(**kwargs):
+    """
+    latency: seconds added to every request
+    bandwidth: bytes/sec per download response, 0 for unlimited
+    size: bytes in every payload
+    episodes: items in /rss
+    traffic: trafficLeft getKeyInfo reports
+    """
+    app = web.Application(middlewares=[count])
+    app['latency'] = kwargs.get('latency', 0)
+    app['bandwidth'] = kwargs.get('bandwidth', 0)
+    app['size'] = int(kwargs.get('size', 2 * 1024 ** 3))
+    app['episodes'] = kwargs.get('episodes', 50)
+    app['traffic'] = int(kwargs.get('traffic', 10 ** 13))
+    app['calls'] = collections.Counter()
+    app.router.add_get('/rss', rss, name='rss')
+    app.router.add_get('/feature/x265', listing, name='listing')
+    app.router.add_get('/feature/x265/b/{page}', listing, name='listing-page')
+    app.router.add_get('/release/{n}', release, name='release')
+    app.router.add_get('/api/v2/getKeyInfo', keyinfo, name='getKeyInfo')
+    app.router.add_get('/api/v2/getFileInfo', fileinfo, name='getFileInfo')
+    app.router.add_get('/api/v2/getDownloadLink', downloadlink, name='getDownloadLink')
+    app.router.add_get('/dl/{id}', download, name='download')
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local feed, release page and NitroFlare stub')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='seconds per request')
+    parser.add_argument('--bandwidth', type=float, default=0, help='bytes/sec per download, 0 unlimited')
+    parser.add_argument('--size', type=float, default=2 * 1024 ** 3, help='payload bytes')
+    parser.add_argument('--episodes', type=int, default=50, help='items in /rss')
+    parser.add_argument('--traffic', type=float, default=10 ** 13, help='premium traffic left, bytes')
+    args = parser.parse_args()
+    web.run_app(make_app(latency=args.latency, bandwidth=args.bandwidth,
+        size=args.size, episodes=args.episodes, traffic=args.traffic), host='127.0.0.1', port=args.port)
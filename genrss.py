@@ -1,17 +1,99 @@
-import requests
-from bs4 import BeautifulSoup
+import os
+import json
+import asyncio
+import argparse
+import aiohttp
+from bs4 import BeautifulSoup, SoupStrainer
 import xml.etree.ElementTree as ET
 from datetime import datetime, timezone
 from urllib.parse import urlparse, urljoin
-import sys
 
-def isit(subs, inthis):
-    if subs in inthis:
-        return subs
-    else:
+from src.release import classify, parse_release, WANTED_CODECS
+
+CONCURRENCY = 8
+TIMEOUT = 30    # seconds
+STATE_FILE = 'genrss.state.json'
+MAX_KNOWN = 5000    # release guids remembered between runs
+
+# only the anchors are parsed, the rest of the page is skipped
+ANCHORS = SoupStrainer('a', href=True)
+
+async def fetch_page(session, uri):
+    try:
+        async with session.get(uri) as response:
+            return await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Failed to fetch {uri}: {e}")
         return None
 
-def generate_rss_feed(uris, output_file='feed.xml',x264ok=False):
+async def fetch_pages(uris, concurrency=CONCURRENCY):
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+            headers={"User-Agent": "Mozilla/5.0"}) as session:
+        return await asyncio.gather(*(fetch_page(session, uri) for uri in uris))
+
+def page_links(text):
+    soup = BeautifulSoup(text, 'html.parser', parse_only=ANCHORS)
+    return soup.find_all('a', href=True)
+
+def load_known(state_file=STATE_FILE):
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get('guids', [])
+    except (OSError, ValueError):
+        return []
+
+def save_known(guids, state_file=STATE_FILE):
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'guids': guids[:MAX_KNOWN]}, f)
+    os.replace(tmp, state_file)
+
+async def fetch_incremental(uris, known, concurrency=CONCURRENCY):
+    """
+    Fetch pages in order, in windows of 1, 2, 4... pages, and stop once a
+    page lists releases and all of them are ones we already know about.
+    """
+    pages = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+            headers={"User-Agent": "Mozilla/5.0"}) as session:
+        window = 1
+        while len(pages) < len(uris):
+            batch = uris[len(pages):len(pages) + window]
+            texts = await asyncio.gather(*(fetch_page(session, uri) for uri in batch))
+            for uri, text in zip(batch, texts):
+                pages.append((uri, text))
+                guids = [guid for guid, _ in page_releases(uri, text)] if text else []
+                # a challenge or error page lists no releases, that says nothing
+                if guids and all(guid in known for guid in guids):
+                    print(f"{uri} holds nothing new, stopping after {len(pages)} page(s)")
+                    return pages
+            window = min(window * 2, concurrency)
+    return pages
+
+def page_releases(uri, text):
+    """
+    (guid, anchor) for every release link on a listing page.
+    """
+    base_url = f"{urlparse(uri).scheme}://{urlparse(uri).netloc}"
+    for link in page_links(text):
+        if parse_release(link.get_text(strip=True)).resolution:
+            yield urljoin(base_url, link['href']), link
+
+def generate_rss_feed(uris, output_file='feed.xml', x264ok=False, **kwargs):
+    """
+    Build the feed from the listing pages. Unless all_pages is set, pages
+    are walked in order and paging stops at the first page holding only
+    releases seen on an earlier run; merge keeps the items of an existing,
+    not yet consumed, output_file. Merge is the default with the early
+    stop, the older pages' items would otherwise not come back.
+    """
+    all_pages = kwargs.get('all_pages', False)
+    merge = kwargs.get('merge', not all_pages)
+    state_file = kwargs.get('state_file', STATE_FILE)
 
     # Start the RSS structure
     rss = ET.Element('rss', version='2.0')
@@ -21,44 +103,68 @@ def generate_rss_feed(uris, output_file='feed.xml',x264ok=False):
     ET.SubElement(channel, 'description').text = 'Filtered links for 1080p releases'
     ET.SubElement(channel, 'lastBuildDate').text = datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %z')
 
-    for uri in uris.split(','):
+    guids = set()
+    if merge and os.path.exists(output_file):
+        for item in ET.parse(output_file).getroot().iter('item'):
+            guids.add(item.findtext('guid'))
+            channel.append(item)
 
-        response = requests.get(uri, headers={"User-Agent": "Mozilla/5.0"})
-        soup = BeautifulSoup(response.text, 'html.parser')
+    uris = uris.split(',')
+    known = load_known(state_file)
+    if all_pages:
+        pages = list(zip(uris, asyncio.run(fetch_pages(uris))))
+    else:
+        pages = asyncio.run(fetch_incremental(uris, set(known)))
 
-        # Parse base URL
-        base_url = f"{urlparse(uri).scheme}://{urlparse(uri).netloc}"
+    fresh = []
+    for uri, text in pages:
+        if not text:
+            continue
 
         # Find all relevant links in the page
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            text = link.get_text(strip=True)
-            splitstr = isit('1080',text.upper())
-            if not splitstr:
-                splitstr = isit('2160',text.upper())
-            if not splitstr:
+        releases = list(page_releases(uri, text))
+        wanted = classify([link.get_text(strip=True) for _, link in releases],
+            resolutions=('1080', '2160'),
+            codecs=None if x264ok else WANTED_CODECS)
+        for (full_url, link), release in zip(releases, wanted):
+            fresh.append(full_url)
+            if not release:
                 continue
-            if splitstr in text and 'NF' in text and \
-                (x264ok or 'HEVC' in text or 'AV1' in text):
-                full_url = urljoin(base_url, href)
-                item = ET.SubElement(channel, 'item')
-                if x264ok:
-                    text = text.replace('264', '265')
-                ET.SubElement(item, 'title').text = text
-                ET.SubElement(item, 'link').text = full_url
-                ET.SubElement(item, 'guid').text = full_url
-                ET.SubElement(item, 'pubDate').text = datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %z')
+            # listings overlap as new releases push older ones down a page
+            if full_url in guids:
+                continue
+            guids.add(full_url)
+            text = release.title
+            item = ET.SubElement(channel, 'item')
+            if x264ok:
+                text = text.replace('264', '265')
+            ET.SubElement(item, 'title').text = text
+            ET.SubElement(item, 'link').text = full_url
+            ET.SubElement(item, 'guid').text = full_url
+            ET.SubElement(item, 'pubDate').text = datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %z')
 
     # Write to file
     tree = ET.ElementTree(rss)
     tree.write(output_file, encoding='utf-8', xml_declaration=True)
     print(f"RSS feed written to {output_file}")
 
+    # newest first, so the cap drops the oldest guids
+    save_known(list(dict.fromkeys(fresh + known)), state_file)
+
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python genrss.py <uri>")
-        sys.exit(1)
-    
-    x264ok = (len(sys.argv) > 2)
-    generate_rss_feed(sys.argv[1], x264ok=x264ok)
+    parser = argparse.ArgumentParser(description='build feed.xml from listing pages')
+    parser.add_argument('uris', help='comma separated listing pages, newest first')
+    parser.add_argument('x264', nargs='?', help='any value also accepts x264 releases')
+    parser.add_argument('--x264ok', action='store_true', help='accept x264 releases')
+    parser.add_argument('--merge', action=argparse.BooleanOptionalAction, default=None,
+        help='add new items to an existing feed.xml instead of rebuilding it,'
+            ' the default unless --all-pages')
+    parser.add_argument('--all-pages', action='store_true',
+        help='fetch every page, no early stop on known releases')
+    args = parser.parse_args()
+
+    generate_rss_feed(args.uris,
+        x264ok=args.x264ok or args.x264 is not None,
+        merge=not args.all_pages if args.merge is None else args.merge,
+        all_pages=args.all_pages)
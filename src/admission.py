@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import logging
+
+
+class AdmissionPlanner:
+    """
+    Hands resolved releases to admit in the order ingest ranked them,
+    highest priority then oldest, across the whole run. Releases resolve
+    out of order, so one that arrives early waits until everything
+    ahead of it has been resolved or dropped; the quota then goes to the
+    releases that deserve it, not the ones whose pages loaded first.
+    """
+
+    def __init__(self, order, admit):
+        self.order = list(order)
+        self.admit = admit
+        self.ready = {}
+        self.position = 0
+        self.ranked = set(self.order)
+
+    def offer(self, key, *release):
+        """
+        key resolved, admit it once its turn comes.
+        """
+        if key not in self.ranked:
+            # not from this run's ingest, nothing to wait for
+            self.admit(key, *release)
+            return
+        self.ready[key] = release
+        self._drain()
+
+    def drop(self, key):
+        """
+        key failed before it could be admitted, stop holding the rest
+        back on it.
+        """
+        if key in self.ranked:
+            self.ready[key] = None
+            self._drain()
+
+    def _drain(self):
+        while self.position < len(self.order) and self.order[self.position] in self.ready:
+            key = self.order[self.position]
+            release = self.ready.pop(key)
+            self.position += 1
+            if release is not None:
+                self.admit(key, *release)
+
+    def flush(self):
+        """
+        Admit whatever is still waiting, in order, once no more releases
+        can arrive.
+        """
+        remaining = self.order[self.position:]
+        missing = sum(1 for key in remaining if key not in self.ready)
+        if missing:
+            logging.warning(f'{missing} release(s) never reached admission')
+        for key in remaining:
+            release = self.ready.pop(key, None)
+            if release is not None:
+                self.admit(key, *release)
+        self.position = len(self.order)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import logging
+import asyncio
+
+from src.metrics import metrics
+
+LINKS_XPATH = '//h4[@class="links"]/following-sibling::pre[@class="links"]'
+
+# Constants
+RENDER_TIMEOUT = 10     # seconds, hard limit on waiting for the links block
+SETTLE = 2              # seconds to keep polling once the document is complete
+FIRST_POLL = 0.05
+MAX_POLL = 1.0
+
+
+def wait_for_links(driver, timeout=RENDER_TIMEOUT, settle=SETTLE):
+    """
+    Poll for a hoster links block with backoff instead of one fixed
+    wait. Gives up at timeout, or settle seconds after the document has
+    finished loading without one. True once a block is there.
+    """
+    from selenium.webdriver.common.by import By
+
+    start = time.monotonic()
+    deadline = start + timeout
+    complete_at = None
+    delay = FIRST_POLL
+    while True:
+        if driver.find_elements(By.XPATH, LINKS_XPATH):
+            return True
+        now = time.monotonic()
+        if complete_at is None and driver.execute_script('return document.readyState') == 'complete':
+            complete_at = now
+        if now >= deadline or (complete_at is not None and now - complete_at >= settle):
+            logging.info(f'No hoster links after {now - start:.1f}s')
+            metrics.inc('autofoo_page_errors_total', method='browser',
+                error='timeout' if now >= deadline else 'no_links')
+            return False
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, MAX_POLL)
+
+
+class BrowserWorker:
+    """
+    One Chrome with its own throwaway profile, restarted when it stops
+    answering or after BROWSER_RECYCLE renders.
+    """
+
+    # Constants
+    RETRY_AFTER = 300   # seconds before trying again after Chrome failed to start
+
+    def __init__(self, sdx, index):
+        self.sdx = sdx
+        self.index = index
+        # chrome_browser_options takes the parent as --user-data-dir
+        self.root = os.path.join(os.path.dirname(sdx.chromeProfilePath), f'worker_{index}')
+        self.profile = os.path.join(self.root, os.path.basename(sdx.chromeProfilePath))
+        self.driver = None
+        self.pages = 0
+        self.failed_at = None
+        self.cookies = None     # picked up by the pool for the http sessions
+
+    def start(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.profile)
+        self.driver = self.sdx.start_driver(self.sdx.chrome_browser_options(self.profile))
+        self.driver.set_page_load_timeout(self.sdx.PAGE_TIMEOUT * 2)
+        self.cookies = self.sdx.setup_request_session(self.driver)
+        self.pages = 0
+        logging.info(f'Browser worker {self.index} started')
+
+    def stop(self):
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+
+    def healthy(self):
+        try:
+            self.driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def render(self, url):
+        from selenium.common.exceptions import WebDriverException, TimeoutException
+
+        if self.driver is not None and not self.healthy():
+            logging.warning(f'Browser worker {self.index} stopped answering, restarting')
+            self.stop()
+        if self.driver is None:
+            if self.failed_at and time.monotonic() - self.failed_at < self.RETRY_AFTER:
+                return None
+            try:
+                self.start()
+                self.failed_at = None
+            except Exception as e:
+                logging.critical(f"Failed to initialize browser: {str(e)}")
+                self.failed_at = time.monotonic()
+                self.stop()
+                return None
+        try:
+            self.driver.get(url)
+            found = wait_for_links(self.driver)
+            # whatever clearance the page handed out, the static path can use
+            self.cookies = self.driver.get_cookies()
+            if not found:
+                return None
+            return self.sdx.extract_links(self.driver.page_source)
+        except WebDriverException as e:
+            logging.error(f'Browser worker {self.index} failed on {url}: {e.msg}')
+            metrics.inc('autofoo_page_errors_total', method='browser',
+                error='timeout' if isinstance(e, TimeoutException) else 'error')
+            self.stop()
+            return None
+        finally:
+            self.pages += 1
+            if self.pages >= self.sdx.BROWSER_RECYCLE:
+                self.stop()
+
+
+class BrowserPool:
+    """
+    A few Chrome workers behind a queue of idle ones, so release pages
+    render side by side. Workers start on first use.
+    """
+
+    # Constants
+    SIZE = 3
+
+    def __init__(self, sdx, size=None):
+        self.sdx = sdx
+        self.workers = [BrowserWorker(sdx, i) for i in range(size or self.SIZE)]
+        self.idle = None
+        self._loop = None
+
+    async def render(self, url):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # queues belong to one event loop, one-shot runs each get their own
+            self._loop = loop
+            self.idle = asyncio.Queue()
+            for worker in self.workers:
+                self.idle.put_nowait(worker)
+        worker = await self.idle.get()
+        try:
+            logging.info(f'Rendering {url} on browser worker {worker.index}')
+            return await asyncio.to_thread(worker.render, url)
+        finally:
+            if worker.cookies:
+                self.sdx.share_cookies(worker.cookies)
+                worker.cookies = None
+            self.idle.put_nowait(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
@@ -1,5 +1,59 @@
+#!/usr/bin/env python3
+import json
+import time
+import logging
 
-class cache:
-    # cache
-    def __init__(self):
-        self.version = '0.1.0'
+from src.metrics import metrics
+
+PREFIX = b'cache:'
+
+
+class Cache:
+    """
+    Expiring json values under one cache:<name>: prefix of the LevelDB,
+    so a run that died part way picks up the work already done.
+    """
+
+    def __init__(self, db, name, ttl):
+        self.db = db
+        self.name = name
+        self.prefix = PREFIX + name.encode('utf-8') + b':'
+        self.ttl = ttl
+
+    def _key(self, key):
+        return self.prefix + key.encode('utf-8')
+
+    def get(self, key):
+        value = self.db.get(self._key(key))
+        if value is None:
+            metrics.inc('autofoo_cache_lookups_total', cache=self.name, result='miss')
+            return None
+        entry = json.loads(value)
+        if entry['expires'] < time.time():
+            self.db.delete(self._key(key))
+            metrics.inc('autofoo_cache_lookups_total', cache=self.name, result='expired')
+            return None
+        metrics.inc('autofoo_cache_lookups_total', cache=self.name, result='hit')
+        return entry['value']
+
+    def put(self, key, value, ttl=None):
+        entry = {'expires': time.time() + (ttl or self.ttl), 'value': value}
+        self.db.put(self._key(key), json.dumps(entry).encode('utf-8'))
+
+    def delete(self, key):
+        self.db.delete(self._key(key))
+
+    def purge(self):
+        """
+        Drop expired entries, returns how many went.
+        """
+        now = time.time()
+        removed = 0
+        with self.db.write_batch() as wb:
+            for key, value in self.db.iterator(prefix=self.prefix):
+                if json.loads(value)['expires'] < now:
+                    wb.delete(key)
+                    removed += 1
+        if removed:
+            logging.info(f'Purged {removed} expired {self.prefix.decode()} entries')
+        return removed
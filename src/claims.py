@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import os
+import time
+import socket
+import sqlite3
+import logging
+
+CLAIMED = 'claimed'
+DONE = 'done'
+
+
+class ClaimStore:
+    """
+    Episode claims shared by every autofoo worker, in one SQLite file.
+    A worker takes a lease on a key before resolving it and keeps it
+    alive while the download runs; a lease that runs out is free for
+    any other worker to take. Done keys stay claimed for good, so they
+    double as the seen history the workers share.
+    """
+
+    # Constants
+    LEASE = 30 * 60     # seconds
+    BUSY_TIMEOUT = 30   # seconds to wait on another worker's write
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.owner = kwargs.get('owner') or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease = kwargs.get('lease', self.LEASE)
+        # autocommit, every statement is its own transaction
+        self.conn = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT,
+            isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS claims (
+            key TEXT PRIMARY KEY, owner TEXT NOT NULL, state TEXT NOT NULL,
+            expires REAL NOT NULL, updated REAL NOT NULL)''')
+        logging.info(f'Claims in {path} as {self.owner}')
+
+    def claim(self, key):
+        """
+        Take the lease on key, True if it is ours. Fails while another
+        worker holds a live lease or once key is done.
+        """
+        now = time.time()
+        cursor = self.conn.execute('''INSERT INTO claims VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                owner = excluded.owner, expires = excluded.expires, updated = excluded.updated
+            WHERE claims.state = ? AND (claims.owner = excluded.owner OR claims.expires < ?)''',
+            (key, self.owner, CLAIMED, now + self.lease, now, CLAIMED, now))
+        return cursor.rowcount == 1
+
+    def renew(self, keys):
+        now = time.time()
+        self.conn.executemany('''UPDATE claims SET expires = ?, updated = ?
+            WHERE key = ? AND owner = ? AND state = ?''',
+            [(now + self.lease, now, key, self.owner, CLAIMED) for key in keys])
+
+    def release(self, key):
+        self.conn.execute('DELETE FROM claims WHERE key = ? AND owner = ? AND state = ?',
+            (key, self.owner, CLAIMED))
+
+    def done(self, key):
+        now = time.time()
+        self.conn.execute('INSERT OR REPLACE INTO claims VALUES (?, ?, ?, ?, ?)',
+            (key, self.owner, DONE, 0, now))
+
+    def done_many(self, keys):
+        """
+        Mark every key done in one transaction.
+        """
+        now = time.time()
+        self.conn.execute('BEGIN')
+        try:
+            self.conn.executemany('INSERT OR REPLACE INTO claims VALUES (?, ?, ?, ?, ?)',
+                [(key, self.owner, DONE, 0, now) for key in keys])
+            self.conn.execute('COMMIT')
+        except sqlite3.Error:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def is_done(self, key):
+        row = self.conn.execute('SELECT 1 FROM claims WHERE key = ? AND state = ?',
+            (key, DONE)).fetchone()
+        return row is not None
+
+    def close(self):
+        self.conn.close()
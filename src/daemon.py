@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import time
+import random
+import signal
+import logging
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from src.metrics import metrics
+from src.pipeline import Pipeline
+
+
+class Daemon:
+    """
+    Long running autofoo. Polls each source on its own jittered interval
+    and keeps one SceneDownload, with its browser, sessions, title index
+    and seen db, warm across cycles.
+    """
+
+    # Constants
+    INTERVAL = 15 * 60      # default seconds between polls of a source
+    JITTER = 0.1            # +/- fraction of the interval
+    CUTOFF = 12             # hours, bounds the first poll of a new feed
+
+    def __init__(self, sdx, sources, **kwargs):
+        self.sdx = sdx
+        self.sources = sources
+        self.metrics_port = kwargs.pop('metrics_port', None)
+        self.pipeline_args = kwargs
+        self.due = {id(source): 0.0 for source in sources}
+        self.stopping = None
+
+    def _reschedule(self, source):
+        interval = source.get('interval', self.INTERVAL)
+        jitter = random.uniform(-self.JITTER, self.JITTER) * interval
+        self.due[id(source)] = time.monotonic() + interval + jitter
+
+    async def _listing(self, source):
+        """
+        Rebuild the listing feed in genrss, returns the FILE source to read.
+        """
+        import genrss
+        output = source.get('output', 'feed.xml')
+        await asyncio.to_thread(genrss.generate_rss_feed,
+            source['source'], output_file=output, merge=True)
+        return {'source': output, 'type': 'FILE'}
+
+    async def cycle(self, sources, pages, api, scheduler):
+        polled = []
+        for source in sources:
+            if source['type'] == 'LISTING':
+                try:
+                    polled.append(await self._listing(source))
+                except Exception as e:
+                    logging.error(f"Listing {source['source'][:60]} failed: {e}")
+            else:
+                polled.append(source)
+        self.sdx.tvshows_.refresh()
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=self.CUTOFF)).timestamp()
+        pipeline = Pipeline(self.sdx, polled,
+            shows=self.sdx.tvshows_, cutoff=cutoff, **self.pipeline_args)
+        await pipeline.run_with(pages, api, scheduler)
+
+    def stop(self):
+        logging.info('Stopping autofoo daemon')
+        self.stopping.set()
+
+    async def run(self):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        sdx = self.sdx
+        logging.info(f'autofoo daemon watching {len(self.sources)} source(s)')
+        exporter = await metrics.serve(self.metrics_port) if self.metrics_port else None
+        leases = asyncio.create_task(sdx.jobs.keep_leases())
+        async with sdx.page_session() as pages, sdx.api_session() as api, \
+                sdx.download_scheduler() as scheduler:
+            while not self.stopping.is_set():
+                now = time.monotonic()
+                due = [source for source in self.sources if self.due[id(source)] <= now]
+                if due:
+                    for source in due:
+                        self._reschedule(source)
+                    try:
+                        with metrics.timer('autofoo_cycle_seconds'):
+                            await self.cycle(due, pages, api, scheduler)
+                    except Exception as e:
+                        # keep the daemon up, start the next render on a fresh browser
+                        logging.error(f'Poll cycle failed: {e}')
+                        metrics.inc('autofoo_cycle_errors_total')
+                        if sdx.pool:
+                            sdx.pool.close()
+                    sdx.seen.close()
+                    metrics.inc('autofoo_cycles_total')
+                    sdx.write_metrics()
+                wait = max(0.0, min(self.due.values()) - time.monotonic())
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            # leaving the scheduler lets running downloads finish
+        leases.cancel()
+        if exporter:
+            await exporter.cleanup()
+        sdx.close()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import logging
+import asyncio
+import aiohttp
+import aiofiles
+from urllib.parse import urlsplit
+
+
+class Stalled(Exception):
+    pass
+
+
+class RangeDownload:
+    """
+    Resumable, multi-segment HTTP Range download into a .part file.
+    Given several mirrors of the file it races them briefly, takes the
+    fastest and moves a segment to the next mirror when it stalls.
+    """
+
+    # Constants
+    PART_SUFFIX = '.part'
+    STATE_SUFFIX = '.part.json'
+    MIN_SEGMENT = 64 * 1024 * 1024     # don't split below 64 MiB per segment
+    MAX_SEGMENTS = 4
+    CHUNK_SIZE = 256 * 1024            # socket read size
+    BUFFER_SIZE = 4 * 1024 * 1024      # bytes buffered per disk write
+    STATE_EVERY = 32 * 1024 * 1024     # persist progress every n bytes
+    PROBE_BYTES = 2 * 1024 * 1024      # read from each mirror in the race
+    PROBE_TIME = 5                     # seconds a mirror gets in the race
+    STALL_WINDOW = 30                  # seconds over which throughput is judged
+    STALL_RATE = 16 * 1024             # bytes/sec below which a mirror has stalled
+
+    def __init__(self, session, url, filepath, size=None, **kwargs):
+        self.session = session
+        # url is one url or a list of mirrors of the same file
+        self.mirrors = list(url) if isinstance(url, (list, tuple)) else [url]
+        self.url = self.mirrors[0]
+        self.filepath = filepath
+        # the hoster's size for the file, what the server sends is checked against it
+        self.expected = int(size) if size else None
+        self.size = self.expected
+        self.max_segments = kwargs.get('max_segments', self.MAX_SEGMENTS)
+        self.limiter = kwargs.get('limiter', None)
+        self.started = time.monotonic()
+        self.transferred = 0
+        self._streamed = 0
+        self.part_path = filepath + self.PART_SUFFIX
+        self.state_path = filepath + self.STATE_SUFFIX
+        self.segments = []
+        self._unsaved = 0
+
+    @classmethod
+    def saved_progress(cls, filepath):
+        """
+        Bytes of filepath already in its .part, as of the last saved state.
+        """
+        try:
+            with open(filepath + cls.STATE_SUFFIX, 'r', encoding='utf-8') as f:
+                return sum(s[2] for s in json.load(f)['segments'])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path) or not os.path.exists(self.part_path):
+            return False
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get('size') != self.size:
+            # a different file now lives behind this name, start over
+            return False
+        self.segments = state['segments']
+        return True
+
+    def _save_state(self):
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'size': self.size, 'segments': self.segments}, f)
+        os.replace(tmp, self.state_path)
+        self._unsaved = 0
+
+    def _plan_segments(self):
+        count = max(1, min(self.max_segments, self.size // self.MIN_SEGMENT))
+        step = -(-self.size // count)
+        # [start, end inclusive, bytes done]
+        self.segments = [[start, min(start + step, self.size) - 1, 0] \
+            for start in range(0, self.size, step)]
+
+    def _preallocate(self):
+        with open(self.part_path, 'wb') as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, self.size)
+            except (AttributeError, OSError):
+                f.truncate(self.size)
+
+    async def _probe(self):
+        """
+        Learn the size and range support with a single byte request.
+        """
+        async with self.session.get(self.url, headers={'Range': 'bytes=0-0'}) as response:
+            if response.status == 206:
+                total = response.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+                if total.isdigit():
+                    self.size = int(total)
+                    return True
+            elif response.status == 200 and response.content_length:
+                self.size = response.content_length
+            elif response.status not in (200, 206):
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history,
+                    status=response.status, message=response.reason)
+        return False
+
+    async def _probe_mirror(self, url):
+        """
+        Time the first PROBE_BYTES of url, returns (size, bytes/sec) or
+        None when the mirror can't serve ranges.
+        """
+        started = time.monotonic()
+        deadline = started + self.PROBE_TIME
+        got = 0
+        headers = {'Range': f'bytes=0-{self.PROBE_BYTES - 1}'}
+        async with self.session.get(url, headers=headers) as response:
+            total = response.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+            if response.status != 206 or not total.isdigit():
+                return None
+            async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                got += len(chunk)
+                if time.monotonic() >= deadline:
+                    break
+        return int(total), got / max(time.monotonic() - started, 1e-6)
+
+    async def _race(self):
+        """
+        Probe every mirror at once and order them fastest first, dropping
+        the ones that fail or disagree on the size. False if none can.
+        """
+        async def probe(url):
+            try:
+                return await asyncio.wait_for(self._probe_mirror(url), self.PROBE_TIME * 2)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Mirror {urlsplit(url).netloc} failed the probe: {e}")
+                return None
+
+        results = await asyncio.gather(*(probe(url) for url in self.mirrors))
+        # (total, rate) per mirror, fastest first
+        raced = sorted(((result[1], result[0], url) \
+            for url, result in zip(self.mirrors, results) if result), reverse=True)
+        if not raced:
+            return False
+        size = self.expected or raced[0][1]
+        raced = [(rate, url) for rate, total, url in raced if total == size]
+        if not raced:
+            logging.warning(f"No mirror of {os.path.basename(self.filepath)} serves {size} bytes")
+            return False
+        logging.info(f"{os.path.basename(self.filepath)} mirrors: " + \
+            ', '.join(f"{urlsplit(url).netloc} {rate / 1e6:.2f} MB/s" for rate, url in raced))
+        self.mirrors = [url for _, url in raced]
+        self.url = self.mirrors[0]
+        self.size = size
+        return True
+
+    def _switch(self, url, reason):
+        """
+        Move url to the back of the mirrors, returns the next one to try.
+        """
+        if self.url == url:
+            self.mirrors.remove(url)
+            self.mirrors.append(url)
+            self.url = self.mirrors[0]
+            logging.warning(f"{os.path.basename(self.filepath)}: {reason} on" \
+                f" {urlsplit(url).netloc}, switching to {urlsplit(self.url).netloc}")
+        return self.url
+
+    @property
+    def completed(self):
+        if self.segments:
+            return sum(s[2] for s in self.segments)
+        return self._streamed
+
+    async def _chunks(self, response):
+        chunks = response.content.iter_chunked(self.CHUNK_SIZE).__aiter__()
+        while True:
+            try:
+                if len(self.mirrors) > 1:
+                    # a silent mirror is a stall too, don't sit out the socket timeout
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self.STALL_WINDOW)
+                else:
+                    chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise Stalled(f'no data for {self.STALL_WINDOW}s')
+            if self.limiter:
+                await self.limiter.consume(len(chunk))
+            self.transferred += len(chunk)
+            yield chunk
+
+    def _progress(self, segment, count):
+        segment[2] += count
+        self._unsaved += count
+        if self._unsaved >= self.STATE_EVERY:
+            self._save_state()
+
+    async def _fetch_segment(self, segment):
+        url = self.url
+        # each mirror gets two chances before the segment gives up
+        for attempt in range(2 * len(self.mirrors)):
+            try:
+                return await self._fetch_range(segment, url)
+            except (aiohttp.ClientError, asyncio.TimeoutError, Stalled) as e:
+                if len(self.mirrors) < 2 or attempt + 1 == 2 * len(self.mirrors):
+                    raise
+                url = self._switch(url, str(e) or type(e).__name__)
+
+    async def _fetch_range(self, segment, url):
+        start, end, done = segment
+        if start + done > end:
+            return
+        headers = {'Range': f'bytes={start + done}-{end}'}
+        async with self.session.get(url, headers=headers) as response:
+            if response.status != 206:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history,
+                    status=response.status, message='range request not honoured')
+            async with aiofiles.open(self.part_path, 'r+b') as f:
+                await f.seek(start + done)
+                buffer = bytearray()
+                window, window_bytes = time.monotonic(), 0
+                async for chunk in self._chunks(response):
+                    buffer += chunk
+                    if len(buffer) >= self.BUFFER_SIZE:
+                        await f.write(buffer)
+                        self._progress(segment, len(buffer))
+                        buffer = bytearray()
+                    window_bytes += len(chunk)
+                    elapsed = time.monotonic() - window
+                    if elapsed >= self.STALL_WINDOW:
+                        if len(self.mirrors) > 1 and window_bytes / elapsed < self.STALL_RATE:
+                            await f.write(buffer)
+                            self._progress(segment, len(buffer))
+                            raise Stalled(f'{window_bytes / elapsed / 1024:.0f} KB/s')
+                        window, window_bytes = time.monotonic(), 0
+                if buffer:
+                    await f.write(buffer)
+                    self._progress(segment, len(buffer))
+
+    async def _fetch_whole(self):
+        """
+        Fallback for servers that ignore Range, no resume possible.
+        """
+        async with self.session.get(self.url) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history,
+                    status=response.status, message=response.reason)
+            async with aiofiles.open(self.part_path, 'wb') as f:
+                buffer = bytearray()
+                async for chunk in self._chunks(response):
+                    buffer += chunk
+                    if len(buffer) >= self.BUFFER_SIZE:
+                        await f.write(buffer)
+                        self._streamed += len(buffer)
+                        buffer = bytearray()
+                if buffer:
+                    await f.write(buffer)
+                    self._streamed += len(buffer)
+
+    def _finish(self, written):
+        """
+        Move the .part into place once written, the bytes actually
+        received, matches the expected size.
+        """
+        if self.expected and written != self.expected:
+            logging.error(f"Size mismatch for {self.part_path}: {written} != {self.expected}")
+            return False
+        os.replace(self.part_path, self.filepath)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return True
+
+    async def run(self):
+        """
+        Download url to filepath, resuming a previous .part if present.
+        """
+        ranged = len(self.mirrors) > 1 and await self._race()
+        ranged = ranged or await self._probe()
+        if self.expected and self.size != self.expected:
+            logging.error(f"{self.url} serves {self.size} bytes, expected {self.expected}")
+            return False
+        if not ranged or not self.size:
+            logging.info(f"{self.url} does not support ranges, streaming whole file")
+            await self._fetch_whole()
+            # nothing was preallocated, the file is exactly what arrived
+            return self._finish(os.path.getsize(self.part_path))
+
+        if self._load_state():
+            done = sum(s[2] for s in self.segments)
+            logging.info(f"Resuming {self.part_path} at {done}/{self.size} bytes")
+        else:
+            self._plan_segments()
+            await asyncio.to_thread(self._preallocate)
+            self._save_state()
+
+        tasks = [asyncio.create_task(self._fetch_segment(s)) for s in self.segments]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # one failed segment fails the transfer, stop the rest before
+            # anything else touches the .part
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # keep whatever progress we made for the next attempt
+            self._save_state()
+
+        if any(start + done <= end for start, end, done in self.segments):
+            logging.error(f"Incomplete download {self.part_path}")
+            return False
+        # the .part was preallocated to size, count the bytes the segments got
+        return self._finish(sum(done for _, _, done in self.segments))
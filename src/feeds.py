@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import json
+import calendar
+import logging
+import feedparser
+
+from src.metrics import metrics
+
+
+def entry_timestamp(entry):
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+    return calendar.timegm(parsed) if parsed else None
+
+
+class FeedState:
+    """
+    Per-feed ETag, Last-Modified and high-water mark (newest processed
+    published timestamp and the guids carrying it), kept in LevelDB.
+    """
+
+    # Constants
+    PREFIX = b'feed:'
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, url):
+        value = self.db.get(self.PREFIX + url.encode('utf-8'))
+        return json.loads(value) if value else {}
+
+    def put(self, url, state):
+        self.db.put(self.PREFIX + url.encode('utf-8'), json.dumps(state).encode('utf-8'))
+
+    def processed(self, state, entry):
+        published = state.get('published')
+        if published is None:
+            return False
+        ts = entry_timestamp(entry)
+        if ts is None:
+            return False
+        guid = entry.get('id') or entry.get('link')
+        return ts < published or (ts == published and guid in state.get('guids', ()))
+
+    def advance(self, state, feed):
+        """
+        New state after feed was fetched, carries the validators and moves
+        the high-water mark up to the newest entry.
+        """
+        new = dict(state)
+        if feed.get('etag'):
+            new['etag'] = feed.etag
+        if feed.get('modified'):
+            new['modified'] = feed.modified
+        for entry in feed.entries:
+            ts = entry_timestamp(entry)
+            if ts is None:
+                continue
+            guid = entry.get('id') or entry.get('link')
+            if new.get('published') is None or ts > new['published']:
+                new['published'] = ts
+                new['guids'] = [guid]
+            elif ts == new['published'] and guid not in new['guids']:
+                new['guids'].append(guid)
+        return new
+
+    def hold(self, state, entries):
+        """
+        Pull the high-water mark back to the oldest of entries, so the
+        next poll offers them again; for entries another worker holds
+        and may yet give up.
+        """
+        stamps = [ts for ts in map(entry_timestamp, entries) if ts is not None]
+        if not stamps:
+            return state
+        new = dict(state, published=min(stamps), guids=[])
+        # the feed may not change before then, fetch it whole next time
+        new.pop('etag', None)
+        new.pop('modified', None)
+        return new
+
+    def poll(self, url, cutoff=None, **kwargs):
+        """
+        Conditional fetch of url. Returns the entries not yet processed,
+        newest first, and the state to put() once they are handled; an
+        unchanged feed returns ([], None) without parsing anything.
+        cutoff bounds the first poll of a feed with no high-water mark.
+        """
+        state = self.get(url)
+        with metrics.timer('autofoo_feed_fetch_seconds', feed=url):
+            feed = feedparser.parse(url,
+                etag=state.get('etag'), modified=state.get('modified'), **kwargs)
+        if feed.get('status') == 304:
+            logging.info(f'{url} not modified')
+            metrics.inc('autofoo_feed_not_modified_total', feed=url)
+            return [], None
+        metrics.inc('autofoo_feed_entries_total', len(feed.entries), feed=url)
+        entries = []
+        for entry in feed.entries:
+            # feeds list newest first, stop at the first one already handled
+            if self.processed(state, entry):
+                break
+            ts = entry_timestamp(entry)
+            if 'published' not in state and cutoff and ts is not None and ts < cutoff:
+                continue
+            entries.append(entry)
+        logging.info(f'{url}: {len(entries)} new of {len(feed.entries)}')
+        return entries, self.advance(state, feed)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+import re
+import abc
+import html
+import time
+import logging
+import asyncio
+import aiohttp
+
+from src.cache import Cache
+from src.metrics import metrics
+
+LINKS_BLOCK = re.compile(r'<pre[^>]*class="links"[^>]*>(.*?)</pre>', re.IGNORECASE | re.DOTALL)
+TAGS = re.compile(r'<[^>]+>')
+
+
+def good(link):
+    test = link.upper()
+    keys = ('.MP4', '.MKV', '.MOV', '.MPG', '.WEBM')
+    return any(key in test for key in keys)
+
+
+class Hoster(abc.ABC):
+    """
+    A file hoster listed on release pages. Finds its links block in the
+    page html and resolves those links into direct download urls.
+    Backends set name and label (the block heading) and implement
+    resolve; base urls come in as kwargs so they can point at stubs.
+    """
+
+    name = None
+    label = None
+
+    def __init__(self, **kwargs):
+        self.heading = re.compile(
+            r'<h4[^>]*class="links"[^>]*>[^<]*' + re.escape(self.label), re.IGNORECASE)
+
+    def extract(self, text):
+        """
+        This hoster's video links in release page html, None when the
+        page has no block for it.
+        """
+        heading = self.heading.search(text)
+        if not heading:
+            return None
+        block = LINKS_BLOCK.search(text, heading.end())
+        if not block:
+            return None
+        links = html.unescape(TAGS.sub('', block.group(1))).strip().split("\n")
+        return [link.strip() for link in links if good(link)]
+
+    async def check(self, session):
+        """
+        True when the account can download right now.
+        """
+        return True
+
+    def quota(self):
+        """
+        Bytes the account can still download, None when unlimited or
+        unknown.
+        """
+        return None
+
+    def charge(self, size):
+        """
+        Take size bytes off the remaining quota.
+        """
+
+    @abc.abstractmethod
+    async def resolve(self, session, links):
+        """
+        Map links onto {'name', 'url', 'size'} dicts, leaving out the
+        ones that can't be downloaded.
+        """
+
+    def expire(self, link):
+        """
+        Forget anything cached for link, its download url went bad.
+        """
+
+
+class NitroFlare(Hoster):
+    """
+    nitroflare.com premium api v2, file info looked up in batches and
+    both lookups cached in the LevelDB.
+    """
+
+    name = 'nitroflare'
+    label = 'NitroFlare:'
+
+    # Constants
+    API = "https://nitroflare.com/api/v2"
+    FILEINFO_BATCH = 50         # file ids per getFileInfo call
+    FILE_TTL = 24 * 3600        # getFileInfo name, size and status
+    LINK_TTL = 4 * 3600         # getDownloadLink urls expire
+    KEY_TTL = 15 * 60           # getKeyInfo, remaining traffic between polls
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.api = kwargs.get('api') or self.API
+        self.user = kwargs.get('user', None)
+        self.key = kwargs.get('key', None)
+        self.info = Cache(kwargs['db'], 'nf-file', kwargs.get('file_ttl') or self.FILE_TTL)
+        self.links = Cache(kwargs['db'], 'nf-link', kwargs.get('link_ttl') or self.LINK_TTL)
+        self.account = Cache(kwargs['db'], 'nf-key', kwargs.get('key_ttl') or self.KEY_TTL)
+        self.files = {}
+        self.keyinfo = None
+        self.keyinfo_stamp = None
+
+    def premium(self):
+        return {"user": self.user, "premiumKey": self.key}
+
+    @staticmethod
+    def file_id(link):
+        return link.split("/")[4]
+
+    async def get_json(self, session, method, params):
+        url = f'{self.api}/{method}'
+        try:
+            with metrics.timer('autofoo_hoster_api_seconds', hoster=self.name, endpoint=method):
+                async with session.get(url, params=params) as response:
+                    if response.status != 200:
+                        logging.warning(f"{url} returned status code: {response.status}")
+                        metrics.inc('autofoo_hoster_api_errors_total',
+                            hoster=self.name, endpoint=method, error=str(response.status))
+                        return None
+                    return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logging.error(f"An error occurred while requesting {url}: {e}")
+            metrics.inc('autofoo_hoster_api_errors_total',
+                hoster=self.name, endpoint=method, error=type(e).__name__)
+            return None
+
+    async def check(self, session):
+        # the cached copy has the traffic this process and earlier runs spent
+        # taken off, so polls inside KEY_TTL don't ask again
+        cached = self.account.get(self.user or '')
+        if cached is None:
+            keyinfo = await self.get_json(session, 'getKeyInfo', self.premium())
+            if keyinfo is not None:
+                cached = {'keyinfo': keyinfo, 'stamp': time.time()}
+                self.account.put(self.user or '', cached)
+        self.keyinfo = cached and cached['keyinfo']
+        self.keyinfo_stamp = cached and cached['stamp']
+        left = self.quota()
+        if left is not None:
+            metrics.set('autofoo_hoster_quota_bytes', left, hoster=self.name)
+        return self.keyinfo is not None
+
+    def quota(self):
+        left = ((self.keyinfo or {}).get('result') or {}).get('trafficLeft')
+        try:
+            return int(float(left)) if left is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    def charge(self, size):
+        left = self.quota()
+        if left is None or not size:
+            return
+        left = self.keyinfo['result']['trafficLeft'] = max(0, left - size)
+        metrics.set('autofoo_hoster_quota_bytes', left, hoster=self.name)
+        # keep the original expiry, the real figure is asked for again then
+        ttl = self.keyinfo_stamp + self.account.ttl - time.time()
+        if ttl > 0:
+            self.account.put(self.user or '',
+                {'keyinfo': self.keyinfo, 'stamp': self.keyinfo_stamp}, ttl)
+
+    async def _file_info(self, session, ids):
+        # getFileInfo takes a comma separated list, so batch the lookups
+        missing = []
+        for file_id in ids:
+            info = self.info.get(file_id)
+            if info is None:
+                missing.append(file_id)
+            else:
+                self.files[file_id] = info
+        batches = [missing[i:i + self.FILEINFO_BATCH] \
+            for i in range(0, len(missing), self.FILEINFO_BATCH)]
+        results = await asyncio.gather(*(
+            self.get_json(session, 'getFileInfo', {"files": ','.join(batch)})
+            for batch in batches))
+        for j in results:
+            if j and isinstance(j.get("result"), dict):
+                for file_id, info in (j["result"].get("files") or {}).items():
+                    self.files[file_id] = info
+                    self.info.put(file_id, info)
+
+    async def _download_link(self, session, file_id):
+        link = self.links.get(file_id)
+        if link is None:
+            params = self.premium()
+            params['file'] = file_id
+            j = await self.get_json(session, 'getDownloadLink', params)
+            if not j or "result" not in j:
+                return None
+            link = {"name": j["result"]["name"], "url": j["result"]["url"]}
+            self.links.put(file_id, link)
+        return link
+
+    async def resolve(self, session, links):
+        ids = {}
+        for link in links:
+            try:
+                ids[link] = self.file_id(link)
+            except IndexError:
+                logging.warning(f'Not a NitroFlare file link: {link}')
+        await self._file_info(session, list(dict.fromkeys(ids.values())))
+
+        async def one(link, file_id):
+            info = self.files.get(file_id)
+            if info and info.get("status", "online") != "online":
+                logging.warning(f"{file_id} is {info.get('status')}, skipping")
+                return None
+            found = await self._download_link(session, file_id)
+            if found is None:
+                return None
+            return dict(found, size=(info or {}).get("size"))
+
+        results = await asyncio.gather(*(one(link, file_id) for link, file_id in ids.items()))
+        return {link: found for link, found in zip(ids, results) if found}
+
+    def expire(self, link):
+        self.links.delete(self.file_id(link))
+
+
+HOSTERS = {hoster.name: hoster for hoster in (NitroFlare,)}
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import json
+import time
+import logging
+import asyncio
+
+QUEUED = 'queued'
+RESOLVING = 'resolving'
+DOWNLOADING = 'downloading'
+DONE = 'done'
+FAILED = 'failed'
+DEFERRED = 'deferred'
+UNFINISHED = (QUEUED, RESOLVING, DOWNLOADING)
+
+
+class JobQueue:
+    """
+    One durable job per release under job:<key> in the LevelDB, moving
+    queued -> resolving -> downloading -> done, or failed with a retry
+    count and a backoff before it is picked up again, or deferred to a
+    later run without using up a retry. Every transition
+    is written straight through so a restart resumes where it stopped.
+    With a ClaimStore, claims are leases shared with the other workers.
+    """
+
+    # Constants
+    PREFIX = b'job:'
+    MAX_RETRIES = 8
+    BACKOFF = 60                # seconds, doubled on every retry
+    MAX_BACKOFF = 12 * 3600
+    KEEP_DONE = 7 * 24 * 3600   # seconds finished jobs are kept around
+    DEFER = 3600                # seconds a deferred job waits
+
+    def __init__(self, db, **kwargs):
+        self.db = db
+        self.max_retries = kwargs.get('max_retries', self.MAX_RETRIES)
+        self.claims = kwargs.get('claims', None)
+        self.claimed = set()    # keys in flight in this process
+
+    def _key(self, key):
+        return self.PREFIX + key.encode('utf-8')
+
+    def get(self, key):
+        value = self.db.get(self._key(key))
+        return json.loads(value) if value else None
+
+    def put(self, job):
+        job['updated'] = time.time()
+        self.db.put(self._key(job['key']), json.dumps(job).encode('utf-8'))
+
+    def add(self, key, url, published, title=None, variants=()):
+        """
+        Queue a new release, returns the job or None if key already has one.
+        """
+        if self.get(key) is not None:
+            return None
+        job = {
+            'key': key, 'url': url, 'published': published, 'title': title,
+            'variants': list(variants), 'state': QUEUED, 'downloads': {},
+            'retries': 0, 'next_try': 0, 'error': None,
+        }
+        self.put(job)
+        return job
+
+    def update(self, key, **fields):
+        job = self.get(key)
+        if job is None:
+            return None
+        job.update(fields)
+        self.put(job)
+        return job
+
+    def claim(self, key):
+        """
+        Take key for this process, False if another worker has it or
+        already finished it.
+        """
+        if key in self.claimed:
+            return True
+        if self.claims and not self.claims.claim(key):
+            return False
+        self.claimed.add(key)
+        return True
+
+    def release(self, key):
+        if key in self.claimed:
+            self.claimed.discard(key)
+            if self.claims:
+                self.claims.release(key)
+
+    async def keep_leases(self):
+        """
+        Renew the shared leases on everything in flight until cancelled.
+        """
+        if self.claims is None:
+            return
+        while True:
+            await asyncio.sleep(self.claims.lease / 3)
+            self.claims.renew(list(self.claimed))
+
+    def resolving(self, key):
+        return self.update(key, state=RESOLVING)
+
+    def downloading(self, key, filepath, offset=0):
+        job = self.get(key)
+        if job is None:
+            return None
+        job['downloads'][filepath] = offset
+        job['state'] = DOWNLOADING
+        self.put(job)
+        return job
+
+    def finished(self, key, filepath, ok, offset=0):
+        """
+        Record one download ending, returns the job once every file it
+        started is on disk.
+        """
+        job = self.get(key)
+        if job is None:
+            return None
+        if not ok:
+            job['downloads'][filepath] = offset
+            self.put(job)
+            self.fail(key, f'download of {filepath} failed at {offset} bytes')
+            return None
+        job['downloads'].pop(filepath, None)
+        if job['downloads']:
+            self.put(job)
+            return None
+        job.update(state=DONE, error=None)
+        self.put(job)
+        self.claimed.discard(key)
+        if self.claims:
+            self.claims.done(key)
+        return job
+
+    def fail(self, key, error):
+        job = self.get(key)
+        self.release(key)
+        if job is None:
+            return None
+        job['retries'] += 1
+        delay = min(self.BACKOFF * 2 ** (job['retries'] - 1), self.MAX_BACKOFF)
+        job.update(state=FAILED, error=error, next_try=time.time() + delay)
+        self.put(job)
+        if job['retries'] > self.max_retries:
+            logging.error(f"Giving up on {key} after {job['retries']} attempts: {error}")
+        else:
+            logging.warning(f"{key} failed ({error}), retry {job['retries']} in {delay:.0f}s")
+        return job
+
+    def defer(self, key, reason, delay=None):
+        """
+        Put a job off until a later run, it keeps its retries.
+        """
+        job = self.get(key)
+        self.release(key)
+        if job is None:
+            return None
+        job.update(state=DEFERRED, error=reason, next_try=time.time() + (delay or self.DEFER))
+        self.put(job)
+        logging.info(f'{key} deferred ({reason})')
+        return job
+
+    def resumable(self, now=None):
+        """
+        Unfinished jobs from earlier runs and failed ones due a retry,
+        skipping any already in flight here.
+        """
+        now = now or time.time()
+        for _, value in self.db.iterator(prefix=self.PREFIX):
+            job = json.loads(value)
+            if job['key'] in self.claimed:
+                continue
+            if job['state'] in UNFINISHED or (job['state'] == DEFERRED and
+                    job['next_try'] <= now) or (job['state'] == FAILED and
+                    job['retries'] <= self.max_retries and job['next_try'] <= now):
+                yield job
+
+    def purge(self, keep=None):
+        """
+        Drop done jobs older than keep seconds, returns how many went.
+        """
+        cutoff = time.time() - (keep or self.KEEP_DONE)
+        removed = 0
+        with self.db.write_batch() as wb:
+            for key, value in self.db.iterator(prefix=self.PREFIX):
+                job = json.loads(value)
+                if job['state'] == DONE and job['updated'] < cutoff:
+                    wb.delete(key)
+                    removed += 1
+        return removed
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import logging
+
+from src.titles import normalize_title
+
+EPISODE = re.compile(r'^(.*?)[\s._-]+S(\d{2,3})E(\d{2,3})(?![0-9])', re.IGNORECASE)
+EXTENSIONS = ('mkv', 'mpeg', 'mp4', 'm4v', 'mpg', 'webm', 'avif', 'ts')
+
+
+def episode_key(name):
+    """
+    Normalized show + SxxEyy of a file or release name, the same form as
+    Release.episode_id, None when the name has no episode marker.
+    """
+    match = EPISODE.search(name)
+    if not match:
+        return None
+    show = normalize_title(match.group(1))
+    if not show:
+        return None
+    return f'{show} S{int(match.group(2)):02d}E{int(match.group(3)):02d}'
+
+
+class Library:
+    """
+    Index of the episodes already in the download directory. Each
+    directory is stored with its mtime, its subdirectories and its video
+    files' size and mtime; a refresh only rescans directories whose
+    mtime moved, so new, deleted and moved files show up without
+    walking the whole tree again.
+    """
+
+    # Constants
+    VERSION = 1
+
+    def __init__(self, root, **kwargs):
+        self.root = os.path.abspath(root)
+        self.index_path = kwargs.get('index_path', None) or \
+            os.path.join(os.getcwd(), 'library.json')
+        self.extensions = tuple(f'.{ext}' for ext in kwargs.get('extensions', EXTENSIONS))
+        self.dirs = {}
+        self.episodes = {}
+        self.loaded = False
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if state.get('version') == self.VERSION and state.get('root') == self.root:
+            self.dirs = state['dirs']
+        self.loaded = True
+
+    def save(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'root': self.root, 'dirs': self.dirs}, f)
+        os.replace(tmp, self.index_path)
+
+    def _scan(self, path, mtime_ns):
+        subdirs = []
+        files = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.name.lower().endswith(self.extensions):
+                        stat = entry.stat()
+                        files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+                except OSError:
+                    continue
+        return {'mtime': mtime_ns, 'dirs': subdirs, 'files': files}
+
+    def refresh(self):
+        """
+        Bring the index up to date with the disk, returns how many
+        directories had to be rescanned.
+        """
+        if not self.loaded:
+            self.load()
+        dirs = {}
+        scanned = 0
+        pending = [self.root]
+        while pending:
+            path = pending.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            known = self.dirs.get(path)
+            if known is None or known['mtime'] != mtime_ns:
+                try:
+                    known = self._scan(path, mtime_ns)
+                except OSError as e:
+                    logging.warning(f'Could not scan {path}: {e}')
+                    continue
+                scanned += 1
+            dirs[path] = known
+            pending.extend(os.path.join(path, name) for name in known['dirs'])
+
+        # a directory that went away is changed too
+        changed = scanned or len(dirs) != len(self.dirs)
+        self.dirs = dirs
+        self.episodes = {}
+        for path, known in dirs.items():
+            for name in known['files']:
+                key = episode_key(name)
+                if key:
+                    self.episodes[key] = os.path.join(path, name)
+        if changed:
+            self.save()
+            logging.info(f'Library {self.root}: {len(self.episodes)} episodes, rescanned {scanned} directories')
+        return scanned
+
+    def add(self, filepath):
+        """
+        Record a finished download without waiting for the next refresh.
+        """
+        key = episode_key(os.path.basename(filepath))
+        if key:
+            self.episodes[key] = filepath
+
+    def get(self, key):
+        return self.episodes.get(key)
+
+    def __contains__(self, key):
+        return key in self.episodes
+
+    def __len__(self):
+        return len(self.episodes)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import bisect
+import logging
+import collections
+from contextlib import contextmanager
+
+# seconds, wide enough for api calls through to whole downloads
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+
+class Metrics:
+    """
+    In-process counters, gauges and latency histograms, cheap enough to
+    leave on. Rendered as Prometheus text for a textfile collector or
+    the /metrics endpoint, and as a JSON summary of the run.
+    """
+
+    # Constants
+    MAX_EVENTS = 1000   # per-file records kept for the summary
+
+    def __init__(self):
+        self.started = time.time()
+        self.help = {}
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+        self.events = collections.defaultdict(lambda: collections.deque(maxlen=self.MAX_EVENTS))
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        self.counters[self._key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # bucket counts, then count, sum, max
+            histogram = self.histograms[key] = [[0] * len(BUCKETS), 0, 0.0, 0.0]
+        i = bisect.bisect_left(BUCKETS, value)
+        if i < len(BUCKETS):
+            histogram[0][i] += 1
+        histogram[1] += 1
+        histogram[2] += value
+        histogram[3] = max(histogram[3], value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def event(self, kind, **fields):
+        self.events[kind].append(fields)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        text = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+            for k, v in pairs)
+        return '{' + text + '}'
+
+    def render(self):
+        """
+        Everything in the Prometheus text exposition format.
+        """
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self.help:
+                    lines.append(f'# HELP {name} {self.help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name, 'counter')
+            lines.append(f'{name}{self._labels(labels)} {value:g}')
+        for (name, labels), value in sorted(self.gauges.items()):
+            header(name, 'gauge')
+            lines.append(f'{name}{self._labels(labels)} {value:g}')
+        for (name, labels), (buckets, count, total, _) in sorted(self.histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, hits in zip(BUCKETS, buckets):
+                cumulative += hits
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+            lines.append(f'{name}_bucket{self._labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{self._labels(labels)} {total:g}')
+            lines.append(f'{name}_count{self._labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        The run as plain JSON, histograms reduced to count, mean and max.
+        """
+        def label(name, labels):
+            return name + self._labels(labels)
+
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'counters': {label(*key): value for key, value in sorted(self.counters.items())},
+            'gauges': {label(*key): value for key, value in sorted(self.gauges.items())},
+            'timings': {label(*key): {'count': count, 'mean': total / count if count else 0.0,
+                'max': peak, 'total': total}
+                for key, (_, count, total, peak) in sorted(self.histograms.items())},
+            'events': {kind: list(records) for kind, records in self.events.items()},
+        }
+
+    @staticmethod
+    def _write(path, text):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def write_prometheus(self, path):
+        self._write(path, self.render())
+
+    def write_summary(self, path):
+        self._write(path, json.dumps(self.summary(), indent=2) + '\n')
+        logging.info(f'Run metrics written to {path}')
+
+    async def serve(self, port, host='127.0.0.1'):
+        """
+        Expose /metrics over http, returns the runner to clean up.
+        """
+        from aiohttp import web
+
+        async def handler(request):
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handler)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logging.info(f'Metrics on http://{host}:{port}/metrics')
+        return runner
+
+
+metrics = Metrics()
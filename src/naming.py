@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import re
+import logging
+from functools import lru_cache
+
+SEASON_EPISODE = re.compile(r"(.*?)(S\d{2,3}E\d{2})", re.IGNORECASE)
+EPISODE_TITLE = re.compile(r"s\d{2,3}e\d{2}\.(.*)", re.IGNORECASE)
+TOKENS = re.compile(r"[._\s]+")
+
+# List of special case words that should stay uppercase
+SPECIAL_CASES = frozenset({
+    "USA", "FBI", "BBC", "CSI", "WILTY",
+    "US", "AU", "PL", "IE", "NZ", "FR", "DE", "JP", "UK",
+    "QI", "XL", "LOL",
+    "WWII", "WPC","TV",
+    "VI", "VII", "VIII", "VIIII", "IX", "II", "III", "IV",
+    "DCI", "HD", "W1A", "HBO", "100K",
+})
+
+# don't expect anything other than mkv, webm, and mp4 in 2025
+FILETYPES = ('mkv', 'mpeg', 'mp4', 'm4v', 'mpg', 'webm', 'avif', 'ts')
+
+
+def load_scene_tags(filepath):
+    """
+    Ripper/scene garbage words, one per line, uppercased to match the
+    tokens they are tested against. Empty when the file is missing.
+    """
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            return frozenset(line.strip().upper() for line in f if line.strip())
+    except FileNotFoundError:
+        logging.warning(f'No scene tags at {filepath}, episode titles are kept whole')
+        return frozenset()
+
+
+@lru_cache(maxsize=65536)
+def case_token(word):
+    """
+    Show and title casing, special cases stay uppercase.
+    """
+    upper = word.upper()
+    return upper if upper in SPECIAL_CASES else word.capitalize()
+
+
+def clean_filename(filename, scene_tags=frozenset()):
+    """
+    Extracts the correct folder and filename from a messy TV episode
+    filename while filtering out scene rippers.
+    """
+
+    fn = filename.replace('_', '.').replace('-', '.').replace(' ', '.')
+    # Extract show name and season/episode
+    match = SEASON_EPISODE.search(fn)
+    if not match:
+        return None, None  # No valid show structure found
+
+    show_raw, season_episode = match.groups()
+
+    # Find episode title, stopping at first garbage word
+    title_match = EPISODE_TITLE.search(fn)
+    episode_title_raw = title_match.group(1) if title_match else ""
+
+    # Stop at the first garbage word
+    filtered_tokens = []
+    for token in TOKENS.split(episode_title_raw.strip()):
+        if token.upper() in scene_tags:
+            break  # Stop at first garbage word
+        if token.lower() in FILETYPES:
+            break
+        filtered_tokens.append(token)
+
+    # Format episode title
+    episode_title = ""
+    if filtered_tokens:
+        episode_title = "." + ".".join(map(case_token, filtered_tokens)).strip(".")
+
+    # Process show name
+    show_name = ".".join(map(case_token, TOKENS.split(show_raw.strip()))).strip(".")
+
+    # Extract file extension
+    extension = filename.split(".")[-1].lower()
+
+    # Generate output
+    folder = show_name.strip()
+    # we use the S00E00 format for specials, movies, etc.
+    if 'S00E00' != season_episode.upper():
+        clean = f"{folder}.{season_episode.upper()}{episode_title}.{extension}"
+    else:
+        clean = f"{folder}{episode_title}.{extension}"
+
+    clean = clean.replace('..','.').replace('..','.')
+    return folder, clean
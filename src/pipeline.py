@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+import os
+import logging
+import asyncio
+import functools
+import feedparser
+from datetime import datetime
+
+from src.admission import AdmissionPlanner
+from src.feeds import FeedState
+from src.library import episode_key
+from src.metrics import metrics
+from src.release import classify, parse_release, best_releases, show_priorities, PREFERENCES
+
+
+def published(entry):
+    return datetime.strptime(entry.published, "%a, %d %b %Y %H:%M:%S %z").timestamp()
+
+
+class Pipeline:
+    """
+    Streaming run: feeds are fetched concurrently and filtered, then
+    release pages, NitroFlare resolution and downloads run as stages
+    joined by bounded queues, so each release moves on as soon as the
+    stage before it is done with it.
+    """
+
+    # Constants
+    QUEUE_SIZE = 16
+    FEED_CONCURRENCY = 4
+
+    def __init__(self, sdx, sources, **kwargs):
+        self.sdx = sdx
+        self.sources = sources
+        self.shows = kwargs.get('shows', sdx.tvshows_)
+        self.resolutions = kwargs.get('resolutions', ('1080',))
+        self.preferences = kwargs.get('preferences', PREFERENCES)
+        self.priority = show_priorities(self.preferences)
+        self.cutoff = kwargs.get('cutoff', None)
+        self.feeds = FeedState(sdx.seen_db)
+        self.page_q = None
+        self.resolve_q = None
+        self.admit = None
+        self.planner = None
+
+    async def _poll(self, limit, source):
+        url = source['source']
+        async with limit:
+            logging.info(url)
+            if source['type'] == 'RSS':
+                # conditional get, only entries past the high-water mark come back
+                entries, state = await asyncio.to_thread(self.feeds.poll, url, self.cutoff)
+                return url, entries, state
+            if source['type'] == 'FILE' and os.path.exists(url):
+                with metrics.timer('autofoo_feed_fetch_seconds', feed=url):
+                    feed = await asyncio.to_thread(feedparser.parse, url)
+                metrics.inc('autofoo_feed_entries_total', len(feed.entries), feed=url)
+                # cleanup the feed.xml file
+                os.remove(url)
+                return url, feed.entries, None
+            logging.info(f"Skipping {source['type']} source {url}")
+            return url, [], None
+
+    def _filter(self, entries):
+        """
+        Quality and show filter, yields (entry, release) candidates.
+        """
+        releases = classify([entry.title for entry in entries],
+            shows=self.shows, resolutions=self.resolutions)
+        metrics.inc('autofoo_entries_evaluated_total', len(entries))
+        for entry, release in zip(entries, releases):
+            if release:
+                metrics.inc('autofoo_entries_accepted_total', stage='filter')
+                yield entry, release
+            else:
+                # parse_release is memoized, telling the two apart costs a lookup
+                reason = 'quality' if not parse_release(entry.title).wanted(
+                    resolutions=self.resolutions) else 'show'
+                metrics.inc('autofoo_entries_rejected_total', reason=reason)
+
+    async def ingest(self):
+        """
+        Feed stage, fetch every source at once and queue one winner per
+        unseen episode, oldest first, along with unfinished jobs from
+        earlier runs. Picking the best variant needs every feed's
+        candidates, so this is the one barrier in the pipeline.
+        """
+        with metrics.timer('autofoo_stage_seconds', stage='ingest'):
+            await self._ingest()
+
+    async def _ingest(self):
+        limit = asyncio.Semaphore(self.FEED_CONCURRENCY)
+        candidates = []
+        polled = []
+        origin = {}
+        for task in asyncio.as_completed([self._poll(limit, source) for source in self.sources]):
+            url, entries, state = await task
+            origin.update((id(entry), url) for entry in entries)
+            logging.info(f'Evaluating {len(entries)} potential shows from {url}')
+            candidates.extend(self._filter(entries))
+            if state is not None:
+                polled.append((url, state))
+
+        jobs = self.sdx.jobs
+        # episodes already on disk cost no page load or hoster lookup
+        library = await asyncio.to_thread(self.sdx.load_library)
+        process = []
+        held = {}
+        for variants in best_releases(candidates, self.preferences):
+            keys = [release.key for _, release in variants]
+            if len(variants) > 1:
+                metrics.inc('autofoo_entries_rejected_total', len(variants) - 1, reason='variant')
+            if not all(self.sdx.not_seen(key) for key in keys):
+                metrics.inc('autofoo_entries_rejected_total', reason='seen')
+                continue
+            if any(jobs.get(key) for key in keys):
+                metrics.inc('autofoo_entries_rejected_total', reason='job')
+                continue
+            entry, release = variants[0]
+            if library is not None and release.episode_id in library:
+                logging.info(f'{release.title} is already at {library.get(release.episode_id)}')
+                metrics.inc('autofoo_entries_rejected_total', reason='library')
+                continue
+            if not jobs.claim(release.key):
+                logging.info(f'{release.title} is taken by another worker')
+                metrics.inc('autofoo_entries_rejected_total', reason='claimed')
+                # not processed here, the feeds offer it again in case the owner dies
+                for variant, _ in variants:
+                    held.setdefault(origin.get(id(variant)), []).append(variant)
+                continue
+            metrics.inc('autofoo_entries_accepted_total', stage='ingest')
+            # seen is only written once the job is done, the job stops repeats until then
+            jobs.add(release.key, entry.link, published(entry), release.title, keys[1:])
+            logging.info(f'Adding {release.title} for further processing, best of {len(variants)}...')
+            process.append((entry.link, release.key, published(entry)))
+
+        # candidates are durable jobs now, move each feed's high-water mark past
+        # them, but not past the ones another worker holds
+        for url, state in polled:
+            self.feeds.put(url, self.feeds.hold(state, held.get(url, ())))
+
+        for job in jobs.resumable():
+            if not jobs.claim(job['key']):
+                continue
+            have = self.sdx.in_library(episode_key(job['key']) or '')
+            if have:
+                logging.info(f"{job['key']} turned up at {have}, nothing to resume")
+                jobs.update(job['key'], downloads={})
+                jobs.finished(job['key'], have, True)
+                continue
+            logging.info(f"Resuming {job['key']} from {job['state']}")
+            metrics.inc('autofoo_jobs_resumed_total')
+            process.append((job['url'], job['key'], job['published']))
+
+        # highest priority shows first, oldest first within them; the planner
+        # admits them against the quota in this order whatever order they resolve in
+        process.sort(key=lambda item: (-self.priority(item[1]), item[2]))
+        self.planner = AdmissionPlanner([key for _, key, _ in process], self.admit)
+        for item in process:
+            await self.page_q.put(item)
+
+    async def _page_worker(self, session):
+        while True:
+            url, test, stamp = await self.page_q.get()
+            try:
+                with metrics.timer('autofoo_stage_seconds', stage='page'):
+                    links = await self.sdx.page_links(session, url)
+                await self.resolve_q.put((links, test, stamp))
+            except Exception as e:
+                logging.error(f'Page stage failed on {url}: {e}')
+                self.sdx.jobs.fail(test, f'page stage: {e}')
+                self.planner.drop(test)
+            finally:
+                self.page_q.task_done()
+
+    async def _resolve_worker(self, session, scheduler, keyinfo):
+        while True:
+            batch = [await self.resolve_q.get()]
+            # take whatever else is waiting so getFileInfo stays batched
+            while not self.resolve_q.empty() and len(batch) < self.sdx.RESOLVE_BATCH:
+                batch.append(self.resolve_q.get_nowait())
+            try:
+                hosters = await keyinfo
+                if not hosters:
+                    raise RuntimeError('no hoster account available')
+                with metrics.timer('autofoo_stage_seconds', stage='resolve'):
+                    await self.sdx.resolve_files(session, batch, scheduler, hosters, self.planner)
+                metrics.inc('autofoo_resolved_total', len(batch))
+            except Exception as e:
+                logging.error(f'Resolve stage failed: {e}')
+                for _, test, _ in batch:
+                    self.sdx.jobs.fail(test, f'resolve stage: {e}')
+                    self.planner.drop(test)
+            finally:
+                for _ in batch:
+                    self.resolve_q.task_done()
+
+    async def run_with(self, pages, api, scheduler):
+        """
+        One pass over the sources on sessions and a scheduler owned by the
+        caller; returns once every release is handed to the scheduler.
+        """
+        self.page_q = asyncio.Queue(self.QUEUE_SIZE)
+        self.resolve_q = asyncio.Queue(self.QUEUE_SIZE)
+        sdx = self.sdx
+        self.admit = functools.partial(sdx.admit_release, scheduler)
+        keyinfo = asyncio.ensure_future(
+            sdx.check_hosters(api))
+        workers = [asyncio.create_task(self._page_worker(pages)) \
+            for _ in range(sdx.PAGE_CONCURRENCY)]
+        workers += [asyncio.create_task(self._resolve_worker(api, scheduler, keyinfo)) \
+            for _ in range(2)]
+        try:
+            await self.ingest()
+            await self.page_q.join()
+            await self.resolve_q.join()
+            self.planner.flush()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if not keyinfo.done():
+                keyinfo.cancel()
+            sdx.seen.flush()
+
+    async def run(self):
+        sdx = self.sdx
+        leases = asyncio.create_task(sdx.jobs.keep_leases())
+        try:
+            async with sdx.page_session() as pages, sdx.api_session() as api, \
+                    sdx.download_scheduler() as scheduler:
+                await self.run_with(pages, api, scheduler)
+                # leaving the scheduler waits on the downloads still running
+        finally:
+            leases.cancel()
+        sdx.seen.close()
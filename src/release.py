@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+import re
+import json
+from functools import lru_cache
+
+from src.titles import normalize_title, title_variants
+
+# one pass over the uppercased title picks up every token we care about
+TOKENS = re.compile(r'''
+    (?<![A-Z0-9])(?:
+        (?P<se>S(?P<season>\d{2,3})E(?P<episode>\d{2})(?:-?E\d{2})*)
+      | (?P<res>2160|1080|720)[PI]?
+      | (?P<codec>AV1|HEVC|[XH]\.?26[45])
+      | (?P<source>NF)
+    )(?![A-Z0-9])''', re.VERBOSE)
+GROUP = re.compile(r'-([A-Z0-9]+)(?:\.(?:MKV|MP4|M4V|MPG|MPEG|WEBM|TS))?(?:\s*\[[^\]]*\])?\s*$')
+SEPARATORS = re.compile(r'[._\s]+')
+SHOW_OF = re.compile(r'^(.*?)[\s._-]+S\d{2,3}E\d{2}', re.IGNORECASE)
+SIZE = re.compile(r'(?<![A-Z0-9.])(\d+(?:\.\d+)?)\s*([MG])I?B(?![A-Z0-9])')
+
+CODECS = {'AV1': 'AV1', 'HEVC': 'HEVC', 'X265': 'HEVC', 'H265': 'HEVC',
+    'X264': 'H264', 'H264': 'H264'}
+WANTED_CODECS = ('AV1', 'HEVC')
+
+# variant scoring, higher wins; size is 'smaller', 'larger' or None;
+# priority ranks shows for the download quota, higher first, unlisted 0
+PREFERENCES = {
+    'resolution': {'2160': 2, '1080': 1, '720': 0},
+    'codec': {'AV1': 2, 'HEVC': 1, 'H264': 0},
+    'size': 'smaller',
+    'priority': {},
+}
+
+
+class Release:
+    """
+    Scene release name broken into its parts. key is the seen-db key,
+    SHOW.NAME.SxxEyy, as sanitize_show has always produced it.
+    """
+
+    __slots__ = ('title', 'key', 'show', 'season', 'episode', 'resolution',
+        'codec', 'source', 'group', 'stem', 'size')
+
+    def __init__(self, title):
+        self.title = title
+        self.key = self.show = self.resolution = None
+        self.season = self.episode = None
+        self.codec = self.source = self.group = None
+        self.stem = self.size = None
+
+    @property
+    def episode_key(self):
+        if self.season is None:
+            return None
+        return f'S{self.season:02d}E{self.episode:02d}'
+
+    @property
+    def episode_id(self):
+        """
+        Normalized show + SxxEyy, shared by every variant of an episode.
+        """
+        if self.season is None:
+            return normalize_title(self.key or self.title)
+        return f'{normalize_title(self.show)} {self.episode_key}'
+
+    def score(self, preferences=PREFERENCES):
+        size = self.size or 0
+        if preferences.get('size') == 'smaller':
+            size = -size if size else float('-inf')
+        elif preferences.get('size') != 'larger':
+            size = 0
+        return (preferences['resolution'].get(self.resolution, -1),
+            preferences['codec'].get(self.codec, -1),
+            size)
+
+    def wanted(self, resolutions=('1080',), codecs=WANTED_CODECS, source='NF'):
+        """
+        Quality filter, codecs=None accepts any codec.
+        """
+        return (self.resolution in resolutions and \
+            (source is None or self.source == source) and \
+            (codecs is None or self.codec in codecs))
+
+    def __repr__(self):
+        return f'Release({self.key!r}, {self.resolution}, {self.codec}, {self.source}, {self.group})'
+
+
+@lru_cache(maxsize=8192)
+def parse_release(title):
+    """
+    Parse a scene title into a Release, memoized per title string.
+    """
+    release = Release(title)
+    test = title.upper()
+    se = None
+    res = None
+    for match in TOKENS.finditer(test):
+        if match.group('se'):
+            # the episode marker only counts ahead of the resolution
+            if se is None and res is None:
+                se = match
+        elif match.group('res'):
+            res = res or match
+        elif match.group('codec'):
+            release.codec = release.codec or CODECS.get(match.group('codec').replace('.', ''))
+        elif match.group('source'):
+            release.source = 'NF'
+
+    group = GROUP.search(test)
+    if group:
+        release.group = group.group(1)
+    size = SIZE.search(test)
+    if size:
+        release.size = int(float(size.group(1)) * (1 << (30 if size.group(2) == 'G' else 20)))
+    if not res:
+        return release
+
+    release.resolution = res.group('res')
+    release.stem = title[:res.start()].strip()
+    pre = test[:res.start()]
+    start = pre.rfind(']') + 1
+    if se and se.start() >= start:
+        release.season = int(se.group('season'))
+        release.episode = int(se.group('episode'))
+        # multi-episode releases key on their first episode, as sanitize_show does
+        release.key = test[start:se.end('episode')].strip().replace(' ', '.')
+        release.show = SEPARATORS.sub(' ', test[start:se.start()]).strip(' -')
+    else:
+        release.key = pre[start:].strip().replace(' ', '.')
+        release.show = SEPARATORS.sub(' ', pre[start:]).strip(' -')
+    return release
+
+
+def parse_releases(titles):
+    return [parse_release(title) for title in titles]
+
+
+def classify(titles, shows=None, **kwargs):
+    """
+    Classify a whole feed in one call. Returns a list aligned with titles
+    holding the Release when it passes the quality filter (and is in
+    shows, when given), otherwise None.
+    """
+    results = []
+    for release in parse_releases(titles):
+        if release.wanted(**kwargs) and (shows is None or release.show in shows):
+            results.append(release)
+        else:
+            results.append(None)
+    return results
+
+
+def load_preferences(filepath='preferences.json'):
+    """
+    Variant preferences, PREFERENCES overlaid with an optional json file.
+    """
+    preferences = {key: (dict(value) if isinstance(value, dict) else value) \
+        for key, value in PREFERENCES.items()}
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for key, value in json.load(f).items():
+                if isinstance(preferences.get(key), dict):
+                    preferences[key].update(value)
+                else:
+                    preferences[key] = value
+    except FileNotFoundError:
+        pass
+    return preferences
+
+
+def show_priorities(preferences=PREFERENCES):
+    """
+    Priority lookup for seen keys, SHOW.NAME.SxxEyy -> the show's
+    preferences['priority'], 0 for shows not listed.
+    """
+    ranks = {}
+    for show, rank in (preferences.get('priority') or {}).items():
+        for key in title_variants(show):
+            ranks[key] = rank
+
+    def priority(key):
+        if not ranks or not key:
+            return 0
+        match = SHOW_OF.search(key)
+        return ranks.get(normalize_title(match.group(1) if match else key), 0)
+    return priority
+
+
+def best_releases(candidates, preferences=PREFERENCES):
+    """
+    Group (item, release) candidates by episode and rank each group best
+    first. Returns the groups in first seen order.
+    """
+    groups = {}
+    for item, release in candidates:
+        groups.setdefault(release.episode_id, []).append((item, release))
+    for variants in groups.values():
+        # stable sort, the earliest listing wins a tie
+        variants.sort(key=lambda variant: variant[1].score(preferences), reverse=True)
+    return list(groups.values())
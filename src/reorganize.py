@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import shutil
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from src.naming import clean_filename, FILETYPES
+
+_scene_tags = frozenset()
+
+
+def _init_worker(scene_tags):
+    # the tags go over once per worker, not once per file
+    global _scene_tags
+    _scene_tags = scene_tags
+
+
+def _clean_names(names):
+    return [clean_filename(name, _scene_tags) for name in names]
+
+
+class Reorganizer:
+    """
+    Bring an existing library into the clean_filename layout, one folder
+    per show. Clean names are worked out in a process pool, then the
+    whole library is handled as one plan: a dry-run diff to review, and
+    moves that write an undo log as they go.
+    """
+
+    # Constants
+    CHUNK = 2000        # names per pool task
+    POOL_MIN = 5000     # below this the pool costs more than it saves
+
+    def __init__(self, root, **kwargs):
+        self.root = os.path.abspath(root)
+        self.target = os.path.abspath(kwargs.get('target', None) or root)
+        self.scene_tags = frozenset(kwargs.get('scene_tags', ()))
+        self.extensions = tuple(f'.{ext}' for ext in kwargs.get('extensions', FILETYPES))
+        self.folders = kwargs.get('folders', True)
+        self.workers = kwargs.get('workers', None)
+
+    def files(self):
+        """
+        Every video file under root, as (directory, name).
+        """
+        pending = [self.root]
+        while pending:
+            path = pending.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.lower().endswith(self.extensions):
+                            yield path, entry.name
+            except OSError as e:
+                logging.warning(f'Could not scan {path}: {e}')
+
+    def clean_names(self, names):
+        """
+        (folder, clean name) for each name, None, None where there's no
+        SxxEyy to go on.
+        """
+        if len(names) < self.POOL_MIN:
+            _init_worker(self.scene_tags)
+            return _clean_names(names)
+        chunks = [names[i:i + self.CHUNK] for i in range(0, len(names), self.CHUNK)]
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                initargs=(self.scene_tags,)) as pool:
+            return [result for chunk in pool.map(_clean_names, chunks) for result in chunk]
+
+    def plan(self):
+        """
+        The moves that would tidy the library, as (source, destination)
+        pairs, plus a list of (source, reason) for files left alone.
+        """
+        found = sorted(self.files())
+        start = time.monotonic()
+        cleaned = self.clean_names([name for _, name in found])
+        logging.info(f'Cleaned {len(found)} names in {time.monotonic() - start:.1f}s')
+
+        moves = []
+        skipped = []
+        taken = set()
+        for (path, name), (folder, clean) in zip(found, cleaned):
+            source = os.path.join(path, name)
+            if not clean:
+                skipped.append((source, 'no SxxEyy in name'))
+                continue
+            destination = os.path.join(self.target, folder, clean) if self.folders and folder \
+                else os.path.join(self.target, clean)
+            if destination == source:
+                continue
+            if destination in taken or os.path.exists(destination):
+                skipped.append((source, f'{destination} already exists'))
+                continue
+            taken.add(destination)
+            moves.append((source, destination))
+        logging.info(f'Plan moves {len(moves)} of {len(found)} files, skips {len(skipped)}')
+        return moves, skipped
+
+    def diff(self, moves, skipped=()):
+        """
+        The plan as text, paths relative to root.
+        """
+        def rel(path):
+            return os.path.relpath(path, self.root)
+
+        lines = [f'- {rel(source)}\n+ {rel(destination)}' for source, destination in moves]
+        lines += [f'! {rel(source)}: {reason}' for source, reason in skipped]
+        return '\n'.join(lines)
+
+    def apply(self, moves, undo_log):
+        """
+        Carry out the moves, logging each one to undo_log as a json line
+        once it is done so a partial run can still be rolled back.
+        Returns how many files moved.
+        """
+        # make every folder up front rather than checking per file
+        for folder in sorted({os.path.dirname(destination) for _, destination in moves}):
+            os.makedirs(folder, exist_ok=True)
+        moved = 0
+        with open(undo_log, 'a', encoding='utf-8') as log:
+            for source, destination in moves:
+                if os.path.exists(destination):
+                    logging.warning(f'{destination} appeared since planning, leaving {source}')
+                    continue
+                try:
+                    os.rename(source, destination)
+                except OSError:
+                    # another filesystem, copy then delete
+                    try:
+                        shutil.move(source, destination)
+                    except OSError as e:
+                        logging.error(f'Could not move {source}: {e}')
+                        continue
+                log.write(json.dumps({'from': source, 'to': destination}) + '\n')
+                moved += 1
+            log.flush()
+            os.fsync(log.fileno())
+        self._prune({os.path.dirname(source) for source, _ in moves})
+        logging.info(f'Moved {moved} files, undo log at {undo_log}')
+        return moved
+
+    def _prune(self, folders):
+        # folders the moves emptied, deepest first, never root itself
+        for folder in sorted(folders, key=len, reverse=True):
+            while folder.startswith(self.root + os.sep):
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    break
+                folder = os.path.dirname(folder)
+
+    @staticmethod
+    def undo(undo_log):
+        """
+        Put back every move recorded in undo_log, newest first.
+        Returns how many files went back.
+        """
+        with open(undo_log, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        restored = 0
+        for record in reversed(records):
+            if os.path.exists(record['from']) or not os.path.exists(record['to']):
+                logging.warning(f"Cannot put back {record['to']}")
+                continue
+            os.makedirs(os.path.dirname(record['from']), exist_ok=True)
+            shutil.move(record['to'], record['from'])
+            restored += 1
+        # drop the show folders the moves made, if they are empty again
+        for folder in sorted({os.path.dirname(record['to']) for record in records}, reverse=True):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass
+        logging.info(f'Put back {restored} of {len(records)} files from {undo_log}')
+        return restored
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import os
+import time
+import logging
+import asyncio
+import aiohttp
+
+from src.download import RangeDownload
+from src.metrics import metrics
+
+
+class RateLimit:
+    """
+    Token bucket shared by every transfer, caps aggregate bytes/sec.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def consume(self, count):
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= count
+            if self.tokens < 0:
+                # holding the lock while we pay off the debt keeps it fair
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+class DownloadScheduler:
+    """
+    Runs downloads oldest first on one shared connector, with a cap on
+    active transfers and an optional aggregate bandwidth limit.
+    """
+
+    # Constants
+    MAX_ACTIVE = 3
+    REPORT_EVERY = 10   # seconds between throughput reports
+
+    def __init__(self, **kwargs):
+        self.max_active = kwargs.get('max_active') or self.MAX_ACTIVE
+        max_rate = kwargs.get('max_rate')
+        self.limiter = RateLimit(max_rate) if max_rate else None
+        self.on_complete = kwargs.get('on_complete', None)
+        self.report_every = kwargs.get('report_every', self.REPORT_EVERY)
+        self.session = None
+        self.queue = None
+        self.active = set()
+        self._tasks = []
+        self._order = 0
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_active * RangeDownload.MAX_SEGMENTS)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.max_active)]
+        self._tasks.append(asyncio.create_task(self._report()))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.queue.join()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.session.close()
+
+    def submit(self, published, url, filepath, title=None, size=None):
+        """
+        Queue a download, lower published timestamps run first. url may
+        be a list of mirrors, the transfer races them.
+        """
+        self._order += 1
+        self.queue.put_nowait((published or 0, self._order, (url, filepath, title, size)))
+
+    async def _worker(self):
+        while True:
+            _, _, (url, filepath, title, size) = await self.queue.get()
+            try:
+                try:
+                    ok = await self._transfer(url, filepath, size)
+                except Exception as e:
+                    # still report it, the job has to leave downloading either way
+                    logging.error(f"Download worker failed on {url}: {e}")
+                    ok = False
+                if self.on_complete:
+                    self.on_complete(url, filepath, title, ok)
+            except Exception as e:
+                logging.error(f"Completing {url} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _transfer(self, url, filepath, size):
+        transfer = RangeDownload(self.session, url, filepath, size, limiter=self.limiter)
+        self.active.add(transfer)
+        metrics.set('autofoo_downloads_active', len(self.active))
+        ok = False
+        try:
+            ok = await transfer.run()
+            return ok
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            logging.error(f"An error occurred while downloading {url}: {e}")
+            return False
+        finally:
+            self.active.discard(transfer)
+            elapsed = max(time.monotonic() - transfer.started, 1e-6)
+            logging.info(f"{os.path.basename(filepath)}: {transfer.transferred / 1e6:.1f} MB" \
+                f" in {elapsed:.1f}s ({transfer.transferred / elapsed / 1e6:.2f} MB/s)")
+            metrics.set('autofoo_downloads_active', len(self.active))
+            metrics.inc('autofoo_downloads_total', result='ok' if ok else 'failed')
+            metrics.inc('autofoo_download_bytes_total', transfer.transferred)
+            metrics.observe('autofoo_download_seconds', elapsed)
+            metrics.event('download', file=os.path.basename(filepath), ok=ok,
+                bytes=transfer.transferred, seconds=elapsed, rate=transfer.transferred / elapsed)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            total = 0.0
+            for transfer in list(self.active):
+                elapsed = max(time.monotonic() - transfer.started, 1e-6)
+                rate = transfer.transferred / elapsed
+                total += rate
+                pct = 100.0 * transfer.completed / transfer.size if transfer.size else 0.0
+                logging.info(f"{os.path.basename(transfer.filepath)}: {pct:.0f}%" \
+                    f" at {rate / 1e6:.2f} MB/s")
+            metrics.set('autofoo_download_rate_bytes', total)
+            metrics.set('autofoo_downloads_queued', self.queue.qsize())
+            if self.active:
+                logging.info(f"{len(self.active)} active, {self.queue.qsize()} queued," \
+                    f" {total / 1e6:.2f} MB/s overall")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+import math
+import struct
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from src.metrics import metrics
+
+CANDIDATE = b'candidate:'
+DOWNLOADED = b'downloaded:'
+NAMESPACES = (CANDIDATE, DOWNLOADED)
+
+META_VERSION = b'meta:seen-version'
+META_COUNT = b'meta:seen-count'
+META_BLOOM = b'meta:seen-bloom'
+META_SHARED = b'meta:claims-shared'  # claims file the history was published to
+VERSION = b'2'
+
+TIMESTAMP = "%Y-%m-%d %H:%M:%S"
+
+
+class BloomFilter:
+    """
+    Plain bloom filter, double hashing over one blake2b digest.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.bits = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+
+    HEADER = struct.Struct('<QQQ')  # bits, hashes, design capacity
+
+    def dumps(self):
+        return self.HEADER.pack(self.bits, self.hashes, self.capacity) + bytes(self.array)
+
+    @classmethod
+    def loads(cls, data):
+        bloom = cls.__new__(cls)
+        bloom.bits, bloom.hashes, bloom.capacity = cls.HEADER.unpack_from(data)
+        bloom.array = bytearray(data[cls.HEADER.size:])
+        return bloom
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for bit in self._positions(key):
+            self.array[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, key):
+        array = self.array
+        for bit in self._positions(key):
+            if not array[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+class SeenStore:
+    """
+    Seen history on top of the LevelDB handle. Keys are namespaced
+    (candidate, downloaded) with a timestamp value, checked through an
+    in-memory bloom filter and written in batches. The filter is rebuilt
+    bigger once the history outgrows the capacity it was sized for.
+    """
+
+    # Constants
+    FLUSH_EVERY = 256
+    ERROR_RATE = 0.01
+    HEADROOM = 2            # capacity over the current count on a rebuild
+    MIN_CAPACITY = 1024
+
+    def __init__(self, db, **kwargs):
+        self.db = db
+        self.flush_every = kwargs.get('flush_every', self.FLUSH_EVERY)
+        self.pending = {}
+        self.dirty = False
+        self._migrate()
+        self.warm()
+
+    def _migrate(self):
+        """
+        Move the pre-namespace keys, the whole db before this version,
+        under candidate: in one batch.
+        """
+        if self.db.get(META_VERSION) == VERSION:
+            return
+        count = 0
+        with self.db.write_batch() as wb:
+            for key, value in self.db.iterator():
+                if key.startswith(NAMESPACES) or key.startswith(b'meta:'):
+                    continue
+                wb.put(CANDIDATE + key, value)
+                wb.delete(key)
+                count += 1
+            wb.put(META_VERSION, VERSION)
+        if count:
+            logging.info(f'Migrated {count} seen entries under {CANDIDATE.decode()}')
+
+    def warm(self):
+        count = self.db.get(META_COUNT)
+        snapshot = self.db.get(META_BLOOM)
+        if count and snapshot and snapshot.startswith(count + b':'):
+            # nothing was written since the filter was saved
+            bloom = BloomFilter.loads(snapshot[len(count) + 1:])
+            if int(count) <= bloom.capacity:
+                self.bloom = bloom
+                self.count = int(count)
+                return
+        self._rebuild(int(count) if count else sum(1 for _ in self._keys()))
+
+    def _rebuild(self, count):
+        # size for HEADROOM times the history, so growth doesn't rebuild every run
+        self.bloom = BloomFilter(max(count * self.HEADROOM, self.MIN_CAPACITY), self.ERROR_RATE)
+        logging.info(f'Sizing the seen filter for {self.bloom.capacity} keys')
+        count = 0
+        for ns, key in self._keys():
+            # the filter holds bare keys, one probe covers every namespace
+            self.bloom.add(key[len(ns):])
+            count += 1
+        self.count = count
+        self.dirty = True
+
+    def _keys(self):
+        for ns in NAMESPACES:
+            for key in self.db.iterator(prefix=ns, include_value=False):
+                yield ns, key
+
+    def keys(self):
+        """
+        Every seen key, bare, whatever its namespace.
+        """
+        self.flush()
+        for ns, key in self._keys():
+            yield key[len(ns):].decode('utf-8')
+
+    def _get(self, test):
+        return test in self.pending or self.db.get(test) is not None
+
+    def seen(self, key, ns=CANDIDATE):
+        key = key.encode('utf-8')
+        if key not in self.bloom:
+            return False
+        return self._get(ns + key)
+
+    def seen_any(self, key):
+        key = key.encode('utf-8')
+        if key not in self.bloom:
+            metrics.inc('autofoo_seen_lookups_total', result='bloom')
+            return False
+        found = any(self._get(ns + key) for ns in NAMESPACES)
+        metrics.inc('autofoo_seen_lookups_total', result='hit' if found else 'miss')
+        return found
+
+    def mark(self, key, ns=CANDIDATE):
+        if self.seen(key, ns):
+            return
+        self.pending[ns + key.encode('utf-8')] = datetime.now().strftime(TIMESTAMP).encode('utf-8')
+        self.bloom.add(key.encode('utf-8'))
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.db.write_batch() as wb:
+            for key, value in self.pending.items():
+                wb.put(key, value)
+            self.count += len(self.pending)
+            wb.put(META_COUNT, str(self.count).encode('utf-8'))
+        self.pending = {}
+        self.dirty = True
+        if self.count > self.bloom.capacity:
+            # past its design capacity the false positive rate climbs fast
+            self._rebuild(self.count)
+
+    def close(self):
+        """
+        Flush and save the filter so the next open skips the key scan.
+        """
+        self.flush()
+        if self.dirty:
+            count = str(self.count).encode('utf-8')
+            with self.db.write_batch() as wb:
+                wb.put(META_COUNT, count)
+                wb.put(META_BLOOM, count + b':' + self.bloom.dumps())
+            self.dirty = False
+
+    def compact(self, days, namespaces=NAMESPACES):
+        """
+        Drop entries older than days and compact the db, returns the
+        number of entries removed.
+        """
+        self.flush()
+        cutoff = (datetime.now() - timedelta(days=days)).strftime(TIMESTAMP).encode('utf-8')
+        removed = 0
+        with self.db.write_batch() as wb:
+            for ns in namespaces:
+                for key, value in self.db.iterator(prefix=ns):
+                    # timestamps sort lexically
+                    if value < cutoff:
+                        wb.delete(key)
+                        removed += 1
+            self.count -= removed
+            wb.put(META_COUNT, str(max(self.count, 0)).encode('utf-8'))
+            wb.delete(META_BLOOM)
+        self.db.compact_range()
+        self.warm()
+        self.close()
+        logging.info(f'Expired {removed} seen entries older than {days} days')
+        return removed
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import os
+import re
+import mmap
+import struct
+import hashlib
+import logging
+
+AMPERSAND = re.compile(r'\s*&\s*')
+APOSTROPHES = re.compile(r"['`‘’]")
+NON_ALNUM = re.compile(r'[^A-Z0-9]+')
+YEAR_SUFFIX = re.compile(r' (?:19|20)\d\d$')
+
+
+def normalize_title(title):
+    """
+    Canonical form of a show title, "Amanda & Alan's Italian Job" and
+    "amanda.and.alans.italian.job" both become AMANDA AND ALANS ITALIAN JOB.
+    """
+    test = AMPERSAND.sub(' AND ', title.upper())
+    test = APOSTROPHES.sub('', test)
+    return NON_ALNUM.sub(' ', test).strip()
+
+
+def title_variants(title):
+    """
+    Alias keys for a tvshows.list entry, the show with and without its year.
+    """
+    key = normalize_title(title)
+    variants = {key} if key else set()
+    bare = YEAR_SUFFIX.sub('', key)
+    if bare:
+        variants.add(bare)
+    return variants
+
+
+class TitleIndex:
+    """
+    Show title index persisted as an mmap'd open addressing hash table,
+    rebuilt only when the source list changes. Opening it costs the same
+    however long tvshows.list gets.
+    """
+
+    # Constants
+    MAGIC = b'AFTIDX01'
+    HEADER = struct.Struct('<8sQQQ')    # magic, source mtime_ns, source size, slots
+    SLOT = struct.Struct('<Q')
+
+    def __init__(self, source, index_path=None):
+        self.source = source
+        self.index_path = index_path or os.path.splitext(source)[0] + '.idx'
+        self._file = None
+        self._map = None
+        self.slots = 0
+
+    @staticmethod
+    def _hash(key):
+        h = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+        return h or 1   # 0 marks an empty slot
+
+    def _stale(self, stat):
+        try:
+            with open(self.index_path, 'rb') as f:
+                magic, mtime_ns, size, _ = self.HEADER.unpack(f.read(self.HEADER.size))
+        except (OSError, struct.error):
+            return True
+        return magic != self.MAGIC or mtime_ns != stat.st_mtime_ns or size != stat.st_size
+
+    def build(self, stat=None):
+        stat = stat or os.stat(self.source)
+        keys = set()
+        with open(self.source, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip() and line[0] != '#':
+                    keys.update(title_variants(line.strip()))
+        slots = 1 << max(4, (2 * len(keys)).bit_length())
+        table = bytearray(slots * self.SLOT.size)
+        mask = slots - 1
+        for key in keys:
+            h = self._hash(key)
+            i = h & mask
+            while self.SLOT.unpack_from(table, i * self.SLOT.size)[0]:
+                i = (i + 1) & mask
+            self.SLOT.pack_into(table, i * self.SLOT.size, h)
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, stat.st_mtime_ns, stat.st_size, slots))
+            f.write(table)
+        os.replace(tmp, self.index_path)
+        logging.info(f'Built title index {self.index_path} with {len(keys)} keys')
+
+    def open(self):
+        stat = os.stat(self.source)
+        if self._stale(stat):
+            self.build(stat)
+        self.close()
+        self._file = open(self.index_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.slots = self.HEADER.unpack_from(self._map, 0)[3]
+        return self
+
+    def refresh(self):
+        """
+        Reopen if tvshows.list changed since the index was mapped.
+        """
+        if self._map is None or self._stale(os.stat(self.source)):
+            return self.open()
+        return self
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def has_key(self, key):
+        if not key:
+            return False
+        h = self._hash(key)
+        mask = self.slots - 1
+        i = h & mask
+        while True:
+            slot = self.SLOT.unpack_from(self._map, self.HEADER.size + i * self.SLOT.size)[0]
+            if slot == h:
+                return True
+            if not slot:
+                return False
+            i = (i + 1) & mask
+
+    def __contains__(self, title):
+        key = normalize_title(title)
+        return self.has_key(key) or self.has_key(YEAR_SUFFIX.sub('', key))
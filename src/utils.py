@@ -3,90 +3,118 @@ import os
 import sys
 import logging
 import time
+import threading
 from datetime import datetime
 import requests
 import asyncio
 import aiohttp
 from pathlib import Path
 import re
+import json
+from http.cookies import SimpleCookie
+from yarl import URL
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from fake_useragent import UserAgent
-
+# selenium, webdriver_manager and fake_useragent are imported on first
+# use, most runs never need a browser
 import plyvel
 
+from src.browser import BrowserPool
+from src.cache import Cache
+from src.hosters import HOSTERS, good
+from src.download import RangeDownload
+from src.jobs import JobQueue
+from src.library import Library
+from src.naming import clean_filename, load_scene_tags, SPECIAL_CASES, FILETYPES
+from src.metrics import metrics
+from src.claims import ClaimStore
+from src.scheduler import DownloadScheduler
+from src.titles import TitleIndex
+from src.release import parse_release
+from src.seen import SeenStore, CANDIDATE, DOWNLOADED, META_SHARED
+
+
 class SceneDownload:
 
     # Constants
     DB_PATH = "./cache/"
-    NTFURL_API = "https://nitroflare.com/api/v2"
-    NTFURL_KEYINFO = f"{NTFURL_API}/getKeyInfo"
-    NTFURL_FILEINFO = f"{NTFURL_API}/getFileInfo"
-    NTFURL_DOWNLOADLINK = f"{NTFURL_API}/getDownloadLink"
-
-    # List of special case words that should stay uppercase
-    SPECIAL_CASES = {
-        "USA", "FBI", "BBC", "CSI", "WILTY",
-        "US", "AU", "PL", "IE", "NZ", "FR", "DE", "JP", "UK",
-        "QI", "XL", "LOL",
-        "WWII", "WPC","TV",
-        "VI", "VII", "VIII", "VIIII", "IX", "II", "III", "IV",
-        "DCI", "HD", "W1A", "HBO", "100K",
-    }
-
-    # don't expect anything other than mkv, webm, and mp4 in 2025
-    FILETYPES = ['mkv', 'mpeg', 'mp4', 'm4v', 'mpg', 'webm', 'avif', 'ts']
+    HOSTERS = ('nitroflare',) # preferred first
+    RESOLVE_BATCH = 50        # releases per resolve call, hosters batch their lookups
+    API_CONCURRENCY = 8       # concurrent hoster api requests
+    PAGE_CONCURRENCY = 8      # concurrent release page fetches
+    PAGE_TIMEOUT = 15         # seconds
+    BROWSER_CACHE_TTL = 7 * 24 * 3600   # re-resolve chromedriver weekly
+    BROWSER_RECYCLE = 200     # restart Chrome after this many renders
+    PAGE_TTL = 30 * 24 * 3600 # release page links
+
+    SCENE_TAGS = '/data/tvtitle_munge.txt'
+    SPECIAL_CASES = SPECIAL_CASES
+    FILETYPES = FILETYPES
 
     def __init__(self, **kwargs):
         self.season_episode_regex = r"(.*?)(S\d{2,3}E\d{2})"
         self.season_episode_title_regex = r"s\d{2,3}e\d{2}\.(.*)"
-        self.driver = None
-        self.seen_db = plyvel.DB(self.DB_PATH, create_if_missing=True) 
-        self.tvshows_ = []
+        self.pool = None
+        self.session = None
+        self.page_cookies = None    # cookie jar of the live aiohttp page session
+        # LevelDB locks its directory, each worker gets its own under DB_PATH
+        self.worker = kwargs.get('worker', None)
+        self.db_path = os.path.join(self.DB_PATH, self.worker) if self.worker else self.DB_PATH
+        os.makedirs(self.db_path, exist_ok=True)
+        self.seen_db = plyvel.DB(self.db_path, create_if_missing=True)
+        self.seen = SeenStore(self.seen_db)
+        claims = kwargs.get('claims', None)
+        self.claims = ClaimStore(claims, owner=self.worker) if claims else None
+        self.jobs = JobQueue(self.seen_db, claims=self.claims)
+        if self.claims:
+            self._share_history()
+        self.pages = Cache(self.seen_db, 'page', kwargs.get('page_ttl', self.PAGE_TTL))
+        self.closed = False
+        self.tvshows_ = None
+        self.library_ = None
+        self.library_index = kwargs.get('library_index', None)
         self.chromeProfilePath = os.path.join(os.getcwd(), "chrome_profile", "scene_profile")
         sys.path.append(self.chromeProfilePath)
         self.profile_dir = os.path.basename(self.chromeProfilePath)
         sys.path.append(self.profile_dir)
+        self.browser_cache = os.path.join(os.path.dirname(self.chromeProfilePath), 'browser.json')
+        # pool workers resolve chromedriver side by side
+        self.browser_cache_lock = threading.Lock()
         #self.seen_file = os.path.join(os.getcwd(),'.','seen_files_load')
         self.log_dir = os.path.join(os.getcwd(), "logs")
+        self.metrics_file = os.path.join(self.log_dir, f'autofoo_metrics_{self._get_timestamp()}.json')
+        self.prometheus_file = kwargs.get('prometheus_file', os.path.join(self.log_dir, 'autofoo.prom'))
         self.download_dir = kwargs.get('download_dir', None)
         self.uxs = kwargs.get('uxs', None)
         self.pxs = kwargs.get('pxs', None)
         self.logging_verbose = kwargs.get('logging_verbose', False)
-        self.scene_tags = []
+        self.max_downloads = kwargs.get('max_downloads', None)
+        self.max_rate = kwargs.get('max_rate', None)
+        self.browser_workers = kwargs.get('browser_workers', None)
+        self.scene_tags = frozenset()
+        self.load_scene_tags(kwargs.get('scene_tags', None) or self.SCENE_TAGS)
+        self.hoster_names = kwargs.get('hosters', None) or self.HOSTERS
+        # per hoster kwargs, api base urls and cache ttls
+        self.hoster_config = kwargs.get('hoster_config', {})
+        self.hosters = []
+        self.link_owners = {}
+        self._init_hosters()
         self._init_logging()
         #self._run_once()
-        self.init_browser(self.chrome_browser_options())
 
     def _view_db(self):
+        self.seen.flush()
         print("\n--- Verifying Seen Data ---")
         for key, value in self.seen_db:
             print(f"Key: {key.decode('utf-8')}, Value: {value.decode('utf-8')}")
             
     def _run_once(self):
         return
-        tmp_file = self.seen_file + '.tmp'
-        with open(self.seen_file, 'r', encoding='utf-8') as fin:
-            with open(tmp_file, 'w', encoding='utf-8') as fout:
-                for line in fin:
-                    key = line.strip().encode('utf-8')
-                    # stage unknown key
-                    if self.seen_db.get(key) is None:
-                        fout.write(line)
-        with open(tmp_file, 'r', encoding='utf-8') as f:
-            # Use a batch to perform multiple writes efficiently
-            with self.seen_db.write_batch() as wb:
-                for line in f:
-                    key = line.strip().encode('utf-8')
-                    # prime
-                    now = datetime.now()
-                    value = now.strftime("%Y-%m-%d %H:%M:%S").encode('utf-8')
-                    self.seen_db.put(key, value)
+        with open(self.seen_file, 'r', encoding='utf-8') as f:
+            # prime, the store batches the writes
+            for line in f:
+                if line.strip():
+                    self.seen.mark(line.strip())
+        self.seen.flush()
 
     def _init_logging(self, **kwargs):
         self.ensure_log_dir()
@@ -109,38 +137,106 @@ class SceneDownload:
         logging.info(f'Goodbye from {str(type(self)).replace("<class '", '').replace("'>",'')}')
 
     def close(self):
-        if self.driver:
-            try:
-                logging.info('Cleanup Chrome')
-                self.driver.quit()
-                self.driver = None
-            except:
-                pass
+        # nothing to do if __init__ failed before the store opened, or
+        # when __del__ follows an explicit close
+        if getattr(self, 'closed', True):
+            return
+        self.closed = True
+        self.pages.purge()
+        for hoster in self.hosters:
+            for name in ('info', 'links', 'account'):
+                cache = getattr(hoster, name, None)
+                if cache:
+                    cache.purge()
+        self.jobs.purge()
+        self.seen.close()
+        if self.claims:
+            self.claims.close()
+            self.claims = self.jobs.claims = None
+        if self.pool:
+            self.pool.close()
+        self.write_metrics(summary=True)
+
+    def _share_history(self):
+        """
+        Publish this worker's seen history to the claims once, workers
+        that start later then skip what it already has.
+        """
+        shared = os.path.abspath(self.claims.path).encode('utf-8')
+        if self.seen_db.get(META_SHARED) == shared:
+            return
+        self.claims.done_many(self.seen.keys())
+        self.seen_db.put(META_SHARED, shared)
+
+    def write_metrics(self, summary=False):
+        """
+        Prometheus text for a textfile collector, plus the JSON run
+        summary when summary is set.
+        """
+        try:
+            self.ensure_log_dir()
+            metrics.write_prometheus(self.prometheus_file)
+            if summary:
+                metrics.write_summary(self.metrics_file)
+        except OSError as e:
+            logging.warning(f'Could not write metrics: {e}')
 
     def set_params(self, **kwargs):
         self.download_dir = kwargs.get('download_dir', self.download_dir)
         self.uxs = kwargs.get('uxs', self.uxs)
         self.pxs = kwargs.get('pxs', self.pxs)
+        self.max_downloads = kwargs.get('max_downloads', self.max_downloads)
+        self.max_rate = kwargs.get('max_rate', self.max_rate)
+        self._init_hosters()
+
+    def _init_hosters(self):
+        self.hosters = [HOSTERS[name](db=self.seen_db, user=self.uxs, key=self.pxs,
+            **self.hoster_config.get(name, {})) for name in self.hoster_names]
 
     # Load garbage words from file
-    def load_scene_tags(self, filepath='/data/tvtitle_munge.txt'):
+    def load_scene_tags(self, filepath=SCENE_TAGS):
         """
         Load ripper/scene garbage words from a file.
         """
-        with open(filepath, "r", encoding="utf-8") as f:
-            self.scene_tags = set(line.strip().lower() for line in f if line.strip())
-
-    def setup_request_session(self):
-        # Create a Requests session
-        self.session = requests.Session()
+        self.scene_tags = load_scene_tags(filepath)
+        return self.scene_tags
+
+    def http_session(self):
+        if self.session is None:
+            # Create a Requests session, presenting the same browser as Chrome
+            self.session = requests.Session()
+            self.session.headers['User-Agent'] = self.user_agent()
+        return self.session
+
+    def setup_request_session(self, driver):
+        session = self.http_session()
         # Get cookies from Selenium and add them to Requests session
-        for cookie in self.driver.get_cookies():
-            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+        cookies = driver.get_cookies()
+        for cookie in cookies:
+            session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+        return cookies
+
+    def share_cookies(self, cookies):
+        """
+        Hand a browser's cookies, clearance included, to the requests
+        session and the live aiohttp page session, so the next pages
+        load over plain http. Call from the event loop.
+        """
+        session = self.http_session()
+        for cookie in cookies:
+            session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+            if self.page_cookies is not None:
+                morsel = SimpleCookie()
+                morsel[cookie['name']] = cookie['value']
+                morsel[cookie['name']]['domain'] = cookie['domain']
+                morsel[cookie['name']]['path'] = cookie.get('path', '/')
+                self.page_cookies.update_cookies(morsel,
+                    URL.build(scheme='https', host=cookie['domain'].lstrip('.')))
 
     def get_first_links(self, url) -> dict:
         # Use the Requests session to make requests with the transferred cookies
-        response = self.session.get(url)
-        print(response.content)
+        response = self.http_session().get(url)
+        logging.debug(response.content)
         return {}
 
     def ensure_log_dir(self):
@@ -155,98 +251,113 @@ class SceneDownload:
 
     def load_tvshows(self):
         """
-        Load tv shows of interest.
+        Load tv shows of interest, as a normalized title index that
+        supports `title in index`.
         """
         tvshows_file = os.path.join(os.getcwd(), 'tvshows.list')
-        with open(tvshows_file, 'r', encoding='utf-8') as f:
-            self.tvshows_ = set(line.strip().upper() \
-                for line in f if line.strip() and line[0] != '#')
-            return self.tvshows_
-
-    def load_page(self, url):
+        if self.tvshows_:
+            self.tvshows_.close()
+        self.tvshows_ = TitleIndex(tvshows_file).open()
+        return self.tvshows_
 
-        def good(link):
-            test = link.upper()
-            keys = ('.MP4', '.MKV', '.MOV', '.MPG', '.WEBM')
-            return any(key in test for key in keys)
+    def load_library(self):
+        """
+        Index of the episodes already in download_dir, refreshed so only
+        directories that changed since the last run are rescanned.
+        """
+        if not self.download_dir:
+            return None
+        if self.library_ is None or self.library_.root != os.path.abspath(self.download_dir):
+            self.library_ = Library(self.download_dir,
+                index_path=self.library_index, extensions=self.FILETYPES)
+        self.library_.refresh()
+        return self.library_
 
-        self.driver.get(url)
-        try:
-            # Wait for the specific HTML structure to render
-            WebDriverWait(self.driver, 1).until(
-                EC.presence_of_element_located((By.XPATH, '//h4[@class="links" and contains(text(), "NitroFlare:")]/following-sibling::pre[@class="links"]'))
-            )
+    def in_library(self, key):
+        """
+        Path of the episode with this Release.episode_id when it is
+        already in download_dir, else None.
+        """
+        return self.library_.get(key) if self.library_ else None
 
-            # Extract the Nitroflare links from the <pre> tag
-            links = self.driver.find_element(By.XPATH, '//h4[@class="links" and contains(text(), "NitroFlare:")]/following-sibling::pre[@class="links"]')
-            links = links.text.strip().split("\n")
-            # print(links)
-            links = [link for link in links if good(link)]
+    good = staticmethod(good)
 
+    def extract_links(self, text):
+        """
+        Links per hoster out of release page html, {name: [links]},
+        None when the page has no block for any of them.
+        """
+        found = {}
+        for hoster in self.hosters:
+            links = hoster.extract(text)
+            if links is not None:
+                found[hoster.name] = links
+        return found or None
+
+    async def fetch_page(self, session, url):
+        try:
+            with metrics.timer('autofoo_page_seconds', method='static'):
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return self.extract_links(await response.text())
+                    logging.warning(f"{url} returned status code: {response.status}")
+                    metrics.inc('autofoo_page_errors_total', method='static', error=str(response.status))
+        except asyncio.TimeoutError:
+            logging.warning(f'Static fetch of {url} timed out')
+            metrics.inc('autofoo_page_errors_total', method='static', error='timeout')
+        except aiohttp.ClientError as e:
+            logging.warning(f'Static fetch of {url} failed: {e}')
+            metrics.inc('autofoo_page_errors_total', method='static', error='error')
+        return None
+
+    def page_session(self):
+        """
+        aiohttp session for release pages, carrying the requests
+        session's cookies and user agent.
+        """
+        connector = aiohttp.TCPConnector(limit=self.PAGE_CONCURRENCY)
+        timeout = aiohttp.ClientTimeout(total=self.PAGE_TIMEOUT)
+        session = self.http_session()
+        pages = aiohttp.ClientSession(
+            connector=connector, timeout=timeout,
+            headers=dict(session.headers),
+            cookies=session.cookies.get_dict())
+        # browsers started later pass their cookies on through this jar
+        self.page_cookies = pages.cookie_jar
+        return pages
+
+    def browser_pool(self):
+        if self.pool is None:
+            self.pool = BrowserPool(self, self.browser_workers)
+        return self.pool
+
+    async def page_links(self, session, url):
+        """
+        Hoster links of a release page, from the cache, else the static
+        html, else a browser render.
+        """
+        links = self.pages.get(url)
+        if links is not None:
+            metrics.inc('autofoo_pages_total', method='cache')
             return links
-
-        except Exception as e:
-            logging.error(f'Exception: {e}')
-            return None
+        links = await self.fetch_page(session, url)
+        if links is None:
+            logging.info(f'Falling back to browser for {url}')
+            with metrics.timer('autofoo_page_seconds', method='browser'):
+                links = await self.browser_pool().render(url)
+            metrics.inc('autofoo_pages_total', method='browser')
+        else:
+            metrics.inc('autofoo_pages_total', method='static')
+        if links:
+            self.pages.put(url, links)
+        return links
 
     def clean_filename(self, filename):
         """
         Extracts the correct folder and filename from a messy TV episode 
         filename while filtering out scene rippers.
         """
-
-        fn = filename.replace('_', '.').replace('-', '.').replace(' ', '.')
-        # Extract show name and season/episode
-        match = re.search(self.season_episode_regex, fn, re.IGNORECASE)
-        if not match:
-            return None, None  # No valid show structure found
-
-        show_raw, season_episode = match.groups()
-
-        # Find episode title, stopping at first garbage word
-        title_match = re.search(self.season_episode_title_regex, fn, re.IGNORECASE)
-        episode_title_raw = title_match.group(1) if title_match else ""
-
-        # Stop at the first garbage word
-        title_tokens = re.split(r"[._\s]+", episode_title_raw.strip())
-        filtered_tokens = []
-        for token in title_tokens:
-            if token.upper() in self.scene_tags:
-                break  # Stop at first garbage word
-            if token.lower() in self.FILETYPES:
-                break
-            filtered_tokens.append(token)
-
-        # Format episode title
-        episode_title = ""
-        if filtered_tokens:
-            formatted_title_tokens = [
-                word.upper() if word.upper() in self.SPECIAL_CASES else word.capitalize()
-                for word in filtered_tokens
-            ]
-            episode_title = "." + ".".join(formatted_title_tokens).strip(".")
-
-        # Process show name
-        show_tokens = re.split(r"[._\s]+", show_raw.strip())
-        formatted_show_tokens = [
-            word.upper() if word.upper() in self.SPECIAL_CASES else word.capitalize()
-            for word in show_tokens
-        ]
-        show_name = ".".join(formatted_show_tokens).strip(".")
-
-        # Extract file extension
-        extension = filename.split(".")[-1].lower()
-
-        # Generate output
-        folder = show_name.strip()
-        # we use the S00E00 format for specials, movies, etc.
-        if 'S00E00' != season_episode.upper():
-            clean_filename = f"{folder}.{season_episode.upper()}{episode_title}.{extension}"
-        else:
-            clean_filename = f"{folder}{episode_title}.{extension}"
-
-        clean_filename = clean_filename.replace('..','.').replace('..','.')
-        return folder, clean_filename
+        return clean_filename(filename, self.scene_tags)
 
     def sanitize_show(self, data):
         test = data.strip().replace(' ','.').upper()
@@ -261,44 +372,48 @@ class SceneDownload:
     def add_seen_show(self, data):
         self.write_seen_entry(data)
 
-    def write_seen_entry(self, data):
-        test = self.sanitize_show(data).strip().encode('utf-8')
-        if self.seen_db.get(test) is None:
-            now = datetime.now()
-            value = now.strftime("%Y-%m-%d %H:%M:%S").encode('utf-8')
-            self.seen_db.put(test, value)
-
-    async def download_file(self, url, filepath, title=None):
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        with open(filepath, 'wb') as f:
-                            while True:
-                                chunk = await response.content.read(4096)
-                                if not chunk:
-                                    break
-                                f.write(chunk)
-                        logging.info(f"Write {url} -> {filepath}")
-                        test='.'.join(filepath.split('/')[-1].split('.')[:-1]).upper()
-                        self.write_seen_entry(test)
-                        if title:
-                            self.write_seen_entry(title)
-                    else:
-                        logging.warning(f"Failed to download {url}, status code: {response.status}")
-            except aiohttp.ClientError as e:
-                logging.error(f"An error occurred while downloading {url}: {e}")
-
-    async def go_download(self, auri):
-        tasks = [self.download_file(url, name, title) for url, name, title in auri]
-        await asyncio.gather(*tasks)
+    def write_seen_entry(self, data, ns=CANDIDATE):
+        key = self.sanitize_show(data).strip()
+        self.seen.mark(key, ns)
+        if self.claims:
+            # the claims are the seen history every worker reads
+            self.claims.done(key)
+
+    def download_complete(self, url, filepath, title, ok):
+        urls = url if isinstance(url, list) else [url]
+        owners = [self.link_owners.pop(u, None) for u in urls]
+        url = urls[0]
+        if not ok:
+            logging.warning(f"Failed to download {url}")
+            for hoster, link in filter(None, owners):
+                # the link may have expired, the retry asks for a fresh one
+                hoster.expire(link)
+            if title:
+                self.jobs.finished(title, filepath, False, RangeDownload.saved_progress(filepath))
+            return
+        logging.info(f"Write {url} -> {filepath}")
+        test='.'.join(filepath.split('/')[-1].split('.')[:-1]).upper()
+        self.write_seen_entry(test, DOWNLOADED)
+        if self.library_:
+            self.library_.add(filepath)
+        if title:
+            self.write_seen_entry(title, DOWNLOADED)
+            job = self.jobs.finished(title, filepath, True)
+            # the episode is on disk, only now are the other variants seen
+            for variant in (job or {}).get('variants', ()):
+                self.write_seen_entry(variant)
+
+    def download_scheduler(self):
+        return DownloadScheduler(
+            max_active=self.max_downloads,
+            max_rate=self.max_rate,
+            on_complete=self.download_complete)
 
     def not_seen(self, test):
-        test = self.sanitize_show(test).strip().encode('utf-8')
-        return (self.seen_db.get(test) is None)
-
-    def nf_premium(self) -> dict:
-        return {"user": self.uxs, "premiumKey": self.pxs}
+        key = self.sanitize_show(test).strip()
+        if self.seen.seen_any(key):
+            return False
+        return not (self.claims and self.claims.is_done(key))
 
     def ensure_chrome_profile(self):
         if not os.path.exists(self.profile_dir):
@@ -307,8 +422,58 @@ class SceneDownload:
             os.makedirs(self.chromeProfilePath)
         return self.chromeProfilePath
 
-    def chrome_browser_options(self):
+    def _load_browser_cache(self):
+        try:
+            with open(self.browser_cache, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if time.time() - cache.get('stamp', 0) > self.BROWSER_CACHE_TTL:
+            return {}
+        return cache
+
+    def _save_browser_cache(self, **kwargs):
+        with self.browser_cache_lock:
+            cache = self._load_browser_cache()
+            cache.update(kwargs)
+            cache.setdefault('stamp', time.time())
+            os.makedirs(os.path.dirname(self.browser_cache), exist_ok=True)
+            # own tmp name, other autofoo processes share this file too
+            tmp = f'{self.browser_cache}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(tmp, self.browser_cache)
+
+    def user_agent(self):
+        """
+        Random browser user agent, cached on disk between runs.
+        """
+        ua = self._load_browser_cache().get('user_agent')
+        if not ua:
+            from fake_useragent import UserAgent
+            ua = UserAgent().random
+            self._save_browser_cache(user_agent=ua)
+        return ua
+
+    def driver_path(self, refresh=False):
+        """
+        Resolved chromedriver path, cached on disk between runs.
+        """
+        path = None if refresh else self._load_browser_cache().get('driver_path')
+        if not path or not os.path.exists(path):
+            from webdriver_manager.chrome import ChromeDriverManager
+            path = ChromeDriverManager().install()
+            self._save_browser_cache(driver_path=path)
+        return path
+
+    def chrome_browser_options(self, profile_path=None):
+        """
+        Chrome options on the scene profile, or on profile_path for a pool worker.
+        """
+        from selenium import webdriver
+
         self.ensure_chrome_profile()
+        profile_path = profile_path or self.chromeProfilePath
         options = webdriver.ChromeOptions()
         options.add_argument("--start-minimized")
         options.add_argument("--headless")
@@ -330,7 +495,7 @@ class SceneDownload:
         options.add_argument("--disable-plugins")
         options.add_argument("--disable-animations")
         options.add_argument("--disable-cache")
-        options.add_argument(f"user-agent={UserAgent().random}")
+        options.add_argument(f"user-agent={self.user_agent()}")
         options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
 
         prefs = {
@@ -339,28 +504,27 @@ class SceneDownload:
         }
         options.add_experimental_option("prefs", prefs)
 
-        if len(self.chromeProfilePath) > 0:
-            initial_path = os.path.dirname(self.chromeProfilePath)
-            self.profile_dir = os.path.basename(self.chromeProfilePath)
-            sys.path.append(self.chromeProfilePath)
-            sys.path.append(self.profile_dir)
+        if len(profile_path) > 0:
+            initial_path = os.path.dirname(profile_path)
             options.add_argument(f'--user-data-dir={initial_path}')
-            options.add_argument(f'--profile-directory={self.profile_dir}')
+            options.add_argument(f'--profile-directory={os.path.basename(profile_path)}')
         else:
             options.add_argument("--incognito")
 
         return options
 
-    def init_browser(self, chrome_options) -> webdriver.Chrome:
+    def start_driver(self, options) -> "webdriver.Chrome":
+        from selenium import webdriver
+        from selenium.common.exceptions import WebDriverException
+        from selenium.webdriver.chrome.service import Service as ChromeService
+
         try:
-            options = chrome_options
-            service = ChromeService(ChromeDriverManager().install())
-            self.driver = webdriver.Chrome(service=service, options=options)
-            self.setup_request_session()
-            return self.driver
-        except Exception as e:
-            logging.critical(f"Failed to initialize browser: {str(e)}")
-            sys.exit(1)
+            service = ChromeService(self.driver_path())
+            return webdriver.Chrome(service=service, options=options)
+        except WebDriverException:
+            # cached chromedriver no longer matches the installed Chrome
+            service = ChromeService(self.driver_path(refresh=True))
+            return webdriver.Chrome(service=service, options=options)
 
     def isit(self, subs, inthis):
         if subs in inthis:
@@ -368,51 +532,126 @@ class SceneDownload:
         else:
             return None
 
-    def download_files(self, files):
-
-        auri = []
-        logging.info(f'We have {len(files)} file(s) to process')
-        response = requests.get(url=self.NTFURL_KEYINFO, params=self.nf_premium())
-        if response.status_code == 200:
-            j = response.json()
-            if files:
-                for f, t in files:
-                    if f:
-                        for uri in f:
-                            if uri:
-                                _file_id = uri.split("/")[4]
-                                params = {"files": _file_id}
-                                response = requests.get(url=self.NTFURL_FILEINFO, params=params)
-                                if response.status_code == 200:
-                                    j = response.json()
-                                    params = self.nf_premium() 
-                                    params['file'] = _file_id
-                                    response = requests.get(url=self.NTFURL_DOWNLOADLINK, params=params)
-                                    if response.status_code == 200:
-                                        j = response.json()
-                                        print(j)
-                                        splitstr = self.isit('1080',j["result"]["name"])
-                                        if not splitstr:
-                                            splitstr = self.isit('2160',j["result"]["name"])
-                                        if not splitstr:
-                                            splitstr = self.isit('720',j["result"]["name"])
-                                        if not splitstr:
-                                            continue
-                                        test = f'''{j["result"]["name"].split(splitstr)[0].strip()}{j["result"]["name"].split('.')[-1]}'''
-                                        _, show_filename = self.clean_filename(test)
-                                        auri.append((
-                                            j["result"]["url"],
-                                            os.path.join(self.download_dir,show_filename),
-                                            t,
-                                        ))
-                            else:
-                                logging.warning('uri exposed as NULL')
-                                logging.info(f'>> {t}, {f}')
-                    else:
-                        logging.warning('files exposed as NULL')
-                        logging.info(f'> {t}, {f}')
-        if auri:
-            asyncio.run(self.go_download(auri))
+    def target_path(self, name):
+        """
+        Map a hoster's file name onto its clean path in download_dir.
+        """
+        release = parse_release(name)
+        if not release.stem:
+            return None
+        test = f"{release.stem}{name.split('.')[-1]}"
+        _, show_filename = self.clean_filename(test)
+        if not show_filename:
+            return None
+        return os.path.join(self.download_dir, show_filename)
+
+    async def check_hosters(self, session):
+        """
+        Hosters whose account can download now, best first.
+        """
+        ok = await asyncio.gather(*(hoster.check(session) for hoster in self.hosters))
+        return [hoster for hoster, usable in zip(self.hosters, ok) if usable]
+
+    def _admit(self, mirrors):
+        """
+        Keep the mirrors whose hoster has quota left for the file and
+        charge the preferred one, None when some file fits nowhere.
+        """
+        charges = {}
+        admitted = {}
+        for filepath, found in mirrors.items():
+            size = next((int(item["size"]) for _, _, item in found if item.get("size")), None)
+            if size:
+                # a resumed transfer only needs what is still missing
+                size -= min(size, RangeDownload.saved_progress(filepath))
+            usable = [(hoster, link, item) for hoster, link, item in found \
+                if size is None or hoster.quota() is None or \
+                    hoster.quota() - charges.get(hoster, 0) >= size]
+            if not usable:
+                logging.warning(f'{os.path.basename(filepath)} needs {size / 1e6:.0f} MB,' \
+                    f' more than the quota left')
+                return None
+            if size:
+                charges[usable[0][0]] = charges.get(usable[0][0], 0) + size
+            admitted[filepath] = usable
+        for hoster, size in charges.items():
+            hoster.charge(size)
+        return admitted
+
+    async def resolve_files(self, session, files, scheduler, hosters=None, planner=None):
+        """
+        Resolve release links on every usable hoster for the whole batch.
+        With a planner the resolved releases go to it, to be admitted in
+        the run's order; without one the batch is admitted here, highest
+        priority then oldest.
+        """
+        hosters = self.hosters if hosters is None else hosters
+        for f, t, published in files:
+            if t:
+                self.jobs.resolving(t)
+            if not f:
+                logging.warning('files exposed as NULL')
+                logging.info(f'> {t}, {f}')
+
+        # each hoster resolves its links for the whole batch at once
+        results = await asyncio.gather(*(
+            hoster.resolve(session, [link for f, _, _ in files if f \
+                for link in f.get(hoster.name, ()) if link])
+            for hoster in hosters))
+
+        releases = []
+        for f, t, published in files:
+            # the same file on several hosters, keyed by where it lands
+            mirrors = {}
+            for hoster, resolved in zip(hosters, results):
+                for link in (f or {}).get(hoster.name, ()):
+                    found = resolved.get(link)
+                    filepath = found and self.target_path(found["name"])
+                    if filepath:
+                        mirrors.setdefault(filepath, []).append((hoster, link, found))
+            if not mirrors:
+                if t:
+                    self.jobs.fail(t, 'no download link resolved')
+                if planner:
+                    planner.drop(t)
+                continue
+            releases.append((t, published, mirrors))
+
+        if planner:
+            for t, published, mirrors in releases:
+                planner.offer(t, published, mirrors)
+            return
+        releases.sort(key=lambda item: item[1] or 0)
+        for t, published, mirrors in releases:
+            self.admit_release(scheduler, t, published, mirrors)
+
+    def admit_release(self, scheduler, t, published, mirrors):
+        """
+        Submit a resolved release to the scheduler with all of its
+        mirrors if the hosters' remaining quota covers it, else defer it
+        to a later run.
+        """
+        admitted = self._admit(mirrors)
+        if admitted is None:
+            metrics.inc('autofoo_admission_total', result='deferred')
+            if t:
+                self.jobs.defer(t, 'not enough download quota left')
+            return False
+        metrics.inc('autofoo_admission_total', result='admitted')
+        for filepath, found in admitted.items():
+            urls = []
+            for hoster, link, item in found:
+                self.link_owners[item["url"]] = (hoster, link)
+                urls.append(item["url"])
+            size = next((item["size"] for _, _, item in found if item.get("size")), None)
+            if t:
+                self.jobs.downloading(t, filepath, RangeDownload.saved_progress(filepath))
+            scheduler.submit(published, urls if len(urls) > 1 else urls[0], filepath, t, size)
+        return True
+
+    def api_session(self):
+        connector = aiohttp.TCPConnector(limit=self.API_CONCURRENCY)
+        return aiohttp.ClientSession(connector=connector)
 
     def test_files(self):
         test_filenames = [